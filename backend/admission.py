@@ -0,0 +1,102 @@
+import math
+import threading
+
+from flask import abort, g, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import cache
+import metrics
+from settings import RATE_LIMITS, CONCURRENCY_LIMITS, TRUSTED_PROXIES
+
+# probes and metrics are always answered
+EXEMPT_ROUTES = ('/healthz', '/readyz', '/metrics')
+
+rejections = metrics.Counter('trivia_admission_rejections_total', 'Requests refused by the admission control.',
+                             ('route_class', 'reason'))
+metrics.counters.append(rejections)
+
+
+def parse_rate(limit):
+    """
+    '10/30' is 10 requests a second with bursts of 30, None for no limit.
+    Raises ValueError for a rate that is not above 0 or a burst below 1.
+    """
+    if not limit:
+        return None
+    rate, _, burst = limit.partition('/')
+    rate, burst = float(rate), float(burst or rate)
+    if not rate > 0 or not burst >= 1:
+        raise ValueError('Rate limit {!r} must have a rate above 0 and a burst of at least 1'.format(limit))
+    return rate, burst
+
+
+def route_class():
+    """search, quiz, write or read, None for the routes admitted anyway"""
+    rule = request.url_rule.rule if request.url_rule else None
+    if rule is None or rule in EXEMPT_ROUTES or request.method == 'OPTIONS':
+        return None
+    if rule == '/questions/search':
+        return 'search'
+    if rule.startswith('/quizzes'):
+        return 'quiz'
+    if request.method in ('GET', 'HEAD'):
+        return 'read'
+    return 'write'
+
+
+"""
+Admission
+    admission control of the requests: a token bucket per client and route,
+    with the rate of the class of the route, answered by a 429 when empty,
+    and a cap on the requests of each class handled at once by the worker,
+    answered by a 503. Both carry Retry-After. The buckets live in the cache
+    backend, so that the workers of a host share them with CACHE_BACKEND=sqlite.
+"""
+
+
+class Admission(object):
+
+    def __init__(self, store, rate_limits=RATE_LIMITS, concurrency_limits=CONCURRENCY_LIMITS):
+        self.store = store
+        self.rate_limits = dict((name, parse_rate(limit)) for name, limit in rate_limits.items() if limit)
+        self.concurrency_limits = dict((name, limit) for name, limit in concurrency_limits.items() if limit)
+        self.semaphores = dict((name, threading.BoundedSemaphore(limit))
+                               for name, limit in self.concurrency_limits.items())
+
+    def admit(self):
+        name = route_class()
+        if name is None:
+            return
+        if name in self.rate_limits:
+            key = 'admission:{} {}:{}'.format(request.method, request.url_rule.rule, request.remote_addr)
+            wait = self.store.take(key, *self.rate_limits[name])
+            if wait:
+                rejections.inc(name, 'rate')
+                g.retry_after = int(math.ceil(wait))
+                abort(429, 'Too many requests, retry in {} seconds'.format(g.retry_after))
+        if name in self.semaphores:
+            if not self.semaphores[name].acquire(blocking=False):
+                rejections.inc(name, 'concurrency')
+                g.retry_after = 1
+                abort(503, 'Too many {} requests in progress, retry shortly'.format(name))
+            g.admitted = name
+
+    def release(self, error=None):
+        # runs once the response is sent, streamed responses included
+        name = g.pop('admitted', None)
+        if name:
+            self.semaphores[name].release()
+
+
+def init_admission(app):
+    # buckets in memory belong to the app, the SQLite backend is shared
+    store = cache.backend if isinstance(cache.backend, cache.SQLiteBackend) else cache.MemoryBackend()
+    admission = app.extensions['admission'] = Admission(store, app.config.get('RATE_LIMITS', RATE_LIMITS),
+                                                        app.config.get('CONCURRENCY_LIMITS', CONCURRENCY_LIMITS))
+    proxies = app.config.get('TRUSTED_PROXIES', TRUSTED_PROXIES)
+    if proxies:
+        # the address of the client is the one forwarded by the proxies
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
+    return admission
@@ -0,0 +1,186 @@
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flaskr import create_app
+from settings import ASGI_THREADS
+
+"""
+ASGI entry point of the API, serving the routes of create_app() unchanged:
+
+    uvicorn asgi:app --workers 4
+
+The event loop owns the client connections, so idle and slow clients
+(quiz players between two questions, keep-alive connections, slow uploads
+and downloads) cost no thread. Each request is handled on a bounded pool of
+ASGI_THREADS threads, which also bounds the database connections a worker
+asks the pool for.
+"""
+
+
+class BodyStream(object):
+    """
+    wsgi.input of a request, pulling the chunks of the request body from
+    the event loop as the app reads them, so that uploads stay streamed
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more_body = True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._more_body = False
+            return
+        self._buffer.extend(message.get('body', b''))
+        self._more_body = message.get('more_body', False)
+
+    def _take(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def read(self, size=-1):
+        while self._more_body and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        return self._take(len(self._buffer) if size is None or size < 0 else size)
+
+    def readline(self, size=-1):
+        while self._more_body and b'\n' not in self._buffer and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self._take(end)
+
+    def __iter__(self):
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+
+def build_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+"""
+AsgiApp
+    ASGI application running a WSGI app. The whole request, including the
+    iteration of a streamed response, runs on one thread of the pool, as
+    Flask keeps the request context in thread locals; response chunks are
+    handed to the event loop as they are produced.
+"""
+
+
+class AsgiApp(object):
+
+    def __init__(self, wsgi_app=None, factory=create_app, threads=ASGI_THREADS):
+        self._wsgi_app = wsgi_app
+        self._factory = factory
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    @property
+    def wsgi_app(self):
+        if self._wsgi_app is None:
+            with self._lock:
+                if self._wsgi_app is None:
+                    self._wsgi_app = self._factory()
+        return self._wsgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope {}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_event_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # the app is created before the first request comes in
+                await loop.run_in_executor(self.executor, lambda: self.wsgi_app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # off the loop, as the responses still streamed from the
+                # threads it waits for need the loop to send their chunks
+                await loop.run_in_executor(None, self.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        loop = asyncio.get_event_loop()
+        environ = build_environ(scope, BodyStream(receive, loop))
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response['status'] = int(status.split(' ', 1)[0])
+                response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                       for name, value in headers]
+
+            def start():
+                if 'started' not in response:
+                    response['started'] = True
+                    send_from_thread({'type': 'http.response.start', 'status': response['status'],
+                                      'headers': response['headers']})
+
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if chunk:
+                        start()
+                        send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                start()
+                send_from_thread({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+
+        await loop.run_in_executor(self.executor, run)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        # the jobs queued by the last requests run before the worker stops
+        jobs = getattr(self._wsgi_app, 'extensions', {}).get('jobs')
+        if jobs:
+            jobs.drain()
+
+
+app = AsgiApp()
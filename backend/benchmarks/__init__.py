@@ -0,0 +1,6 @@
+"""
+benchmarks
+    micro-benchmarks of the Question and Category read methods and a load
+    test of every endpoint, run against a database filled with synthetic
+    questions at a configurable scale. See `python -m benchmarks --help`.
+"""
@@ -0,0 +1,89 @@
+import argparse
+import os
+import platform
+import sys
+import tempfile
+import time
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmarks the trivia API against synthetic data.')
+    parser.add_argument('--database', help='SQLAlchemy url of an empty database to fill, '
+                                           'a SQLite file of the temp directory by default')
+    parser.add_argument('--scale', type=int, default=10000, help='number of questions, 10000 by default')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated data and requests')
+    parser.add_argument('--iterations', type=int, default=500, help='calls per micro-benchmark')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of load per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients of the load test')
+    parser.add_argument('--url', help='load test the server listening at this url instead of an in-process one')
+    parser.add_argument('--with-admission', action='store_true',
+                        help='keep the rate and concurrency limits of the admission control, which the load '
+                             'test of a single host would otherwise hit')
+    parser.add_argument('--skip-micro', action='store_true', help='skip the micro-benchmarks')
+    parser.add_argument('--skip-load', action='store_true', help='skip the load test')
+    parser.add_argument('--skip-startup', action='store_true', help='skip the cold start benchmark')
+    parser.add_argument('--startup-runs', type=int, default=5, help='cold starts per startup variant')
+    parser.add_argument('--output', help='file the results are written to, as json')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown against the baseline failing the run, 0.2 (20%%) by default')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ['DATABASE_URL'] = args.database or 'sqlite:///{}'.format(
+        os.path.join(tempfile.gettempdir(), 'trivia-benchmark-{}.sqlite3'.format(args.scale)))
+    # settings read DATABASE_URL when they are first imported
+    from flaskr import create_app
+    from models import db, Category
+    from benchmarks import data, load, micro, results, startup
+
+    app = create_app()
+    if not args.with_admission:
+        admission = app.extensions['admission']
+        admission.rate_limits.clear()
+        admission.semaphores.clear()
+    with app.app_context():
+        started = time.perf_counter()
+        if data.populate(args.scale, args.seed):
+            print('populated {} questions in {:.1f} s'.format(args.scale, time.perf_counter() - started))
+        category_ids = [category.get('id') for category in Category.get_categories()]
+        dialect = db.engine.dialect.name
+
+    report = {
+        'scale': args.scale,
+        'database': dialect,
+        'python': platform.python_version(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'micro': {},
+        'load': {},
+        'startup': {}
+    }
+    if not args.skip_micro:
+        report['micro'] = micro.run(app, args.scale, args.iterations, args.seed)
+    if not args.skip_load:
+        report['load'] = load.run(app, args.scale, category_ids, args.duration, args.concurrency, args.seed,
+                                  args.url)
+    if not args.skip_startup:
+        report['startup'] = startup.run(os.environ['DATABASE_URL'], args.startup_runs)
+
+    for section in ('micro', 'load', 'startup'):
+        for name, summary in sorted(report[section].items()):
+            print('{:<7} {:<42} p50 {:>8.2f} ms  p95 {:>8.2f} ms  p99 {:>8.2f} ms  {:>9.1f} ops/s  {} errors'.format(
+                section, name, summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['throughput'],
+                summary['errors']))
+    if args.output:
+        results.save(report, args.output)
+    if args.baseline:
+        regressions = results.compare(report, results.load(args.baseline), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import random
+
+from models import db, Question, Category
+
+# the categories seeded by the test suite
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sport']
+
+WORDS = ['what', 'which', 'who', 'where', 'when', 'river', 'painter', 'country', 'capital', 'oscar', 'movie',
+         'team', 'world', 'cup', 'largest', 'organ', 'body', 'palace', 'mirrors', 'city', 'artist', 'dutch',
+         'boxer', 'original', 'name', 'invented', 'discovered', 'branch', 'medicine', 'ancient', 'egyptians',
+         'beetle', 'lake', 'africa', 'fantasy', 'directed', 'author', 'autobiography', 'tournament', 'century',
+         'planet', 'element', 'composer', 'symphony', 'novel', 'mountain', 'ocean', 'empire', 'battle', 'king']
+
+"""
+populate(scale, seed)
+    fills an empty database with the six categories of the test suite and
+    `scale` random questions. A database already holding `scale` questions
+    is left as it is, any other content is refused.
+"""
+
+
+def populate(scale, seed=0, chunk_size=5000):
+    existing = Question.count()
+    if existing == scale and Category.get_categories():
+        return False
+    if existing or Category.get_categories():
+        raise RuntimeError('the benchmark database holds {} questions, '
+                           'use an empty database or a scale of {}'.format(existing, existing))
+    for category in CATEGORIES:
+        Category(type=category).insert()
+    category_ids = [category.get('id') for category in Category.get_categories()]
+    generator = random.Random(seed)
+    chunk = []
+    for _ in range(scale):
+        chunk.append({
+            'question': ' '.join(generator.choice(WORDS) for _ in range(generator.randint(6, 14))).capitalize() + '?',
+            'answer': ' '.join(generator.choice(WORDS) for _ in range(generator.randint(1, 3))).title(),
+            'category': generator.choice(category_ids),
+            'difficulty': generator.randint(1, 5)
+        })
+        if len(chunk) == chunk_size:
+            Question.bulk_insert(chunk)
+            chunk = []
+    Question.bulk_insert(chunk)
+    db.session.remove()
+    return True
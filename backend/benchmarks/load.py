@@ -0,0 +1,90 @@
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from werkzeug.serving import make_server
+
+from benchmarks.data import WORDS
+from benchmarks.results import summarize
+
+
+def scenarios(scale, category_ids):
+    """
+    returns name: request factory of every endpoint. A factory takes a
+    random generator and returns (method, path, json body).
+    """
+    last_page = max(scale // 10, 1)
+    return {
+        'GET /categories': lambda generator: ('GET', '/categories', None),
+        'GET /questions': lambda generator: ('GET', '/questions?page={}'.format(generator.randint(1, last_page)), None),
+        'GET /categories/<id>/questions': lambda generator: (
+            'GET', '/categories/{}/questions?stream=1'.format(generator.choice(category_ids)), None),
+        'POST /questions/search': lambda generator: (
+            'POST', '/questions/search', {'searchTerm': generator.choice(WORDS)}),
+        'POST /quizzes': lambda generator: (
+            'POST', '/quizzes', {'previous_questions': [], 'quiz_category': {'id': generator.choice(category_ids)}})
+    }
+
+
+def drive(host, port, scenario, duration, concurrency, seed):
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        generator = random.Random(seed + index)
+        while time.perf_counter() < deadline:
+            method, path, body = scenario(generator)
+            started = time.perf_counter()
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            try:
+                connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                   headers={'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'})
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                failed = True
+            finally:
+                connection.close()
+            with lock:
+                samples.append(time.perf_counter() - started)
+                errors[0] += failed
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return summarize(samples, time.perf_counter() - started, errors[0])
+
+
+"""
+run(app, ...)
+    load tests every endpoint for `duration` seconds with `concurrency`
+    clients, against `app` served by a threaded WSGI server on the loopback
+    interface, or against the server already listening at `url`
+"""
+
+
+def run(app, scale, category_ids, duration, concurrency, seed=0, url=None):
+    server = None
+    if url:
+        host, port = urlsplit(url).hostname, urlsplit(url).port or 80
+    else:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        host, port = '127.0.0.1', server.server_port
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        return dict((name, drive(host, port, scenario, duration, concurrency, seed))
+                    for name, scenario in sorted(scenarios(scale, category_ids).items()))
+    finally:
+        if server:
+            server.shutdown()
@@ -0,0 +1,46 @@
+import random
+import time
+
+from models import Question, Category
+from quiz import SeenSet
+from benchmarks.data import WORDS
+from benchmarks.results import summarize
+
+
+def benchmarks(scale, generator):
+    """
+    returns name: (callable, share of the iterations) of every benchmark.
+    Listing a whole category is O(scale), so it runs less often.
+    """
+    category_ids = [category.get('id') for category in Category.get_categories()]
+    last_page = max(scale // 10, 1)
+    return {
+        'Category.get_categories': (Category.get_categories, 1),
+        'Category.get_category_by_id': (lambda: Category.get_category_by_id(generator.choice(category_ids)), 1),
+        'Question.count': (Question.count, 1),
+        'Question.get_questions_page': (lambda: Question.get_questions_page(generator.randint(1, last_page), 10), 1),
+        'Question.get_questions_after': (lambda: Question.get_questions_after(generator.randint(0, scale), 10), 1),
+        'Question.get_questions_by_category_id': (
+            lambda: Question.get_questions_by_category_id(generator.choice(category_ids)), 0.1),
+        'Question.search_question_by_term': (
+            lambda: Question.search_question_by_term(generator.choice(WORDS), 1, 10), 1),
+        'Question.get_random_question': (
+            lambda: Question.get_random_question(SeenSet(), {'id': generator.choice(category_ids)}), 1)
+    }
+
+
+def run(app, scale, iterations, seed=0):
+    results = {}
+    generator = random.Random(seed)
+    with app.app_context():
+        for name, (benchmark, share) in sorted(benchmarks(scale, generator).items()):
+            # the first call fills the caches and the in-memory indexes
+            benchmark()
+            samples = []
+            started = time.perf_counter()
+            for _ in range(max(int(iterations * share), 1)):
+                call_started = time.perf_counter()
+                benchmark()
+                samples.append(time.perf_counter() - call_started)
+            results[name] = summarize(samples, time.perf_counter() - started)
+    return results
@@ -0,0 +1,62 @@
+import json
+import math
+
+"""
+summarize(samples, elapsed)
+    latency percentiles, in milliseconds, of a list of durations in seconds
+    and the throughput reached over `elapsed` seconds
+"""
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[max(int(math.ceil(fraction * len(ordered))) - 1, 0)]
+
+
+def summarize(samples, elapsed, errors=0):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'errors': errors,
+        'mean_ms': sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'throughput': len(ordered) / elapsed if elapsed else 0.0
+    }
+
+
+def save(results, path):
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def compare(results, baseline, tolerance, min_delta_ms=0.5):
+    """
+    returns the regressions of `results` against `baseline`: benchmarks whose
+    p95 latency grew, or endpoints whose throughput dropped, by more than `tolerance`
+    (0.2 for 20%). Latency changes under `min_delta_ms` are treated as noise.
+    """
+    regressions = []
+    for section in ('micro', 'load', 'startup'):
+        for name, current in sorted(results.get(section, {}).items()):
+            previous = baseline.get(section, {}).get(name)
+            if not previous:
+                continue
+            if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance) and \
+                    current['p95_ms'] - previous['p95_ms'] > min_delta_ms:
+                regressions.append('{} {}: p95 {:.2f} ms, baseline {:.2f} ms'.format(
+                    section, name, current['p95_ms'], previous['p95_ms']))
+            # the throughput of a micro-benchmark is its mean latency inverted
+            if section == 'load' and current['throughput'] < previous['throughput'] * (1 - tolerance):
+                regressions.append('{} {}: {:.1f} ops/s, baseline {:.1f} ops/s'.format(
+                    section, name, current['throughput'], previous['throughput']))
+            if current.get('errors') and not previous.get('errors'):
+                regressions.append('{} {}: {} errors'.format(section, name, current['errors']))
+    return regressions
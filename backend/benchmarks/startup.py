@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.results import summarize
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# environment of the workers compared, on top of the one of the benchmark
+VARIANTS = {
+    'default': {},
+    'no-ddl': {'MIGRATE_ON_STARTUP': 'false'},
+    'no-warmup': {'WARMUP': 'off'}
+}
+
+# run by a fresh interpreter, printing the durations of its cold start
+WORKER = '''
+import json
+import time
+
+started = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.extensions['startup'].wait()
+ready = time.perf_counter()
+client = app.test_client()
+client.get('/questions')
+first_request = time.perf_counter()
+client.get('/questions')
+second_request = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'ready': ready - started,
+    'first_request': first_request - ready,
+    'second_request': second_request - first_request
+}))
+'''
+
+"""
+run(database_url, runs)
+    cold starts of a worker, each in a new interpreter: time to import the
+    app, to create it, until it is ready, of its first two requests, and
+    of the whole process, for every variant of VARIANTS
+"""
+
+
+def run(database_url, runs):
+    results = {}
+    for variant, environment in sorted(VARIANTS.items()):
+        samples = {}
+        for _ in range(runs):
+            env = dict(os.environ, DATABASE_URL=database_url, **environment)
+            started = time.perf_counter()
+            output = subprocess.check_output([sys.executable, '-c', WORKER], cwd=BACKEND, env=env)
+            durations = json.loads(output.decode().strip().splitlines()[-1])
+            durations['process'] = time.perf_counter() - started
+            for name, duration in durations.items():
+                samples.setdefault(name, []).append(duration)
+        for name, durations in samples.items():
+            results['{} {}'.format(variant, name)] = summarize(durations, sum(durations))
+    return results
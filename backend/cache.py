@@ -0,0 +1,319 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from settings import CACHE_BACKEND, CACHE_PATH
+from tenants import namespaced
+
+
+def take_token(bucket, rate, burst, now):
+    """
+    token bucket filled with `rate` tokens a second up to `burst`: returns
+    the bucket, [tokens, time], once a token is taken from it, and the
+    seconds to wait for a token, 0 when one was taken
+    """
+    tokens, updated = bucket if bucket else (burst, now)
+    tokens = min(float(burst), tokens + max(now - updated, 0) * rate)
+    if tokens >= 1:
+        return [tokens - 1, now], 0.0
+    return [tokens, now], (1 - tokens) / rate
+
+
+"""
+MemoryBackend
+    key/value store living in the memory of the current process.
+    Every worker keeps its own copy, so a write in one worker is only seen
+    by the others once their entries expire.
+"""
+
+
+class MemoryBackend(object):
+    # expired entries are purged once every PURGE_EVERY writes
+    PURGE_EVERY = 500
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        self._data[key] = (value, now + ttl if ttl else None)
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            with self._lock:
+                self._purge(now)
+
+    def _purge(self, now):
+        for expired in [k for k, (_, expires_at) in list(self._data.items())
+                        if expires_at is not None and expires_at <= now]:
+            self._data.pop(expired, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = (self.get(key) or 0) + 1
+            self._data[key] = (value, None)
+            return value
+
+    def take(self, key, rate, burst):
+        with self._lock:
+            now = time.time()
+            bucket, wait = take_token(self.get(key), rate, burst, now)
+            # a bucket left alone until it is full again is as good as gone
+            self._data[key] = (bucket, now + burst / rate)
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(now)
+            return wait
+
+    def clear(self):
+        self._data.clear()
+
+
+"""
+SQLiteBackend
+    key/value store kept in a local SQLite file. Every worker of the host
+    opens the same file, so a version bump in one worker invalidates the
+    entries of all the others.
+"""
+
+
+class SQLiteBackend(object):
+    # expired rows are purged once every PURGE_EVERY writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                               '(key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                           (key, json.dumps(value), time.time() + ttl if ttl else None))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            connection.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+
+    def incr(self, key):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            value = (json.loads(row[0]) if row else 0) + 1
+            connection.execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, NULL)',
+                               (key, json.dumps(value)))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return value
+
+    def take(self, key, rate, burst):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = connection.execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+            bucket = json.loads(row[0]) if row and row[1] > now else None
+            bucket, wait = take_token(bucket, rate, burst, now)
+            connection.execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                               (key, json.dumps(bucket), now + burst / rate))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            connection.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+        return wait
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+
+def create_backend(name=CACHE_BACKEND, path=CACHE_PATH):
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend(path or os.path.join(tempfile.gettempdir(), 'trivia-cache.sqlite3'))
+    raise ValueError('Unknown cache backend {}'.format(name))
+
+
+backend = create_backend()
+
+
+"""
+Cache
+    read-through cache for one namespace. Keys are prefixed with the
+    namespace version, so bump() invalidates every entry of the namespace
+    at once, in every worker sharing the backend. Every tenant has its own
+    namespace, and so its own version.
+"""
+
+
+class Cache(object):
+
+    def __init__(self, namespace, ttl):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def version(self):
+        return backend.get('{}:version'.format(namespaced(self.namespace))) or 0
+
+    def bump(self):
+        return backend.incr('{}:version'.format(namespaced(self.namespace)))
+
+    def get_or_set(self, key, loader):
+        versioned_key = '{}:{}:{}'.format(namespaced(self.namespace), self.version(), key)
+        entry = backend.get(versioned_key)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = loader()
+        # values are boxed so that a cached None is told apart from a miss
+        backend.set(versioned_key, [value], self.ttl)
+        return value
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': self.version()
+        }
+
+
+caches = {}
+
+
+def get_cache(namespace, ttl):
+    if namespace not in caches:
+        caches[namespace] = Cache(namespace, ttl)
+    return caches[namespace]
+
+
+def stats():
+    return dict((namespace, cache.stats()) for namespace, cache in caches.items())
+
+
+class Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+"""
+SingleFlight
+    lets the concurrent callers of a function with the same key share one
+    call: the first one runs it, the others wait for its result. With a
+    ttl, the result is also kept that many seconds in the worker. Results
+    are handed to every caller as they are, callers must not change them.
+"""
+
+
+class SingleFlight(object):
+
+    def __init__(self, name, ttl=0):
+        self.name = name
+        self.ttl = ttl
+        self.calls = 0
+        self.shared = 0
+        self.hits = 0
+        self._flights = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            if self.ttl:
+                entry = self._results.get(key)
+                if entry is not None and entry[1] > time.time():
+                    self.hits += 1
+                    return entry[0]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self.calls += 1
+                if self.ttl and flight.error is None:
+                    now = time.time()
+                    # entries of the keys no longer asked for go with the next expiry
+                    for expired in [k for k, (_, expires_at) in self._results.items() if expires_at <= now]:
+                        del self._results[expired]
+                    self._results[key] = (flight.value, now + self.ttl)
+            flight.done.set()
+        return flight.value
+
+    def stats(self):
+        callers = self.calls + self.shared + self.hits
+        return {
+            'calls': self.calls,
+            'shared': self.shared,
+            'hits': self.hits,
+            # callers served without a query of their own
+            'ratio': (self.shared + self.hits) / callers if callers else 0.0
+        }
+
+
+flights = {}
+
+
+def get_flight(name, ttl=0):
+    if name not in flights:
+        flights[name] = SingleFlight(name, ttl)
+    return flights[name]
+
+
+def flight_stats():
+    return dict((name, flight.stats()) for name, flight in flights.items())
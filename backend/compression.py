@@ -0,0 +1,113 @@
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+import cache
+from settings import COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL, BROTLI_QUALITY, COMPRESSION_CACHE_SIZE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'application/vnd.trivia.columns+json',
+                          'application/msgpack', 'text/csv', 'text/plain', 'text/html')
+
+"""
+CompressedCache
+    least recently used compressed bodies, keyed by the ETag of the response
+    and the encoding, so that a hot page is compressed once per version
+"""
+
+
+class CompressedCache(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_set(self, key, compress):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        self.misses += 1
+        data = compress()
+        with self._lock:
+            self._entries[key] = data
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return data
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries)
+        }
+
+
+compressed_cache = cache.caches['compression'] = CompressedCache(COMPRESSION_CACHE_SIZE)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, COMPRESSION_LEVEL)
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # lets stream_with_context pop the request context of the stream
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+"""
+compress_response(response)
+    compresses the body of a response with the best encoding the client
+    accepts, brotli when the brotli package is installed, gzip otherwise.
+    Bodies smaller than COMPRESSION_MIN_SIZE are sent as they are, and
+    streamed responses are gzipped on the fly.
+"""
+
+
+def compress_response(response):
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    encodings = ['br', 'gzip'] if brotli and not response.is_streamed else ['gzip']
+    encoding = request.accept_encodings.best_match(encodings)
+    if not encoding:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        response.response = gzip_stream(response.response)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return response
+    etag, _ = response.get_etag()
+    if etag:
+        data = compressed_cache.get_or_set((etag, encoding), lambda: compress(data, encoding))
+    else:
+        data = compress(data, encoding)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,43 @@
+import json
+
+from flask import Response, request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# lists sent as one list of values per field rather than one object per item
+COLUMNS = 'application/vnd.trivia.columns+json'
+MSGPACK = 'application/msgpack'
+
+
+def columns(items, fields):
+    """the dicts of `items` as {field: [value of every item]}, keys written once"""
+    return dict((field, [item.get(field) for item in items]) for field in fields)
+
+
+def compact_mimetype():
+    """
+    the compact encoding the client prefers to plain JSON, None when it
+    prefers plain JSON. MessagePack is only offered once the msgpack
+    package is installed.
+    """
+    offers = ['application/json', COLUMNS] + ([MSGPACK] if msgpack else [])
+    mimetype = request.accept_mimetypes.best_match(offers)
+    return mimetype if mimetype in (COLUMNS, MSGPACK) else None
+
+
+"""
+compact_response(mimetype, envelope, key, items, fields)
+    the envelope with the list `items` under `key` in the columnar layout,
+    as JSON or as MessagePack
+"""
+
+
+def compact_response(mimetype, envelope, key, items, fields):
+    body = dict(envelope)
+    body[key] = columns(items, fields)
+    if mimetype == MSGPACK:
+        return Response(msgpack.packb(body, use_bin_type=True), mimetype=MSGPACK)
+    return Response(json.dumps(body, separators=(',', ':')), mimetype=COLUMNS)
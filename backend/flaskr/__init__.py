@@ -1,35 +1,337 @@
 
-from flask import Flask, request, abort, jsonify
+import base64
+import binascii
+import csv
+import io
+import json
+import logging
+from flask import Flask, Response, request, abort, jsonify, g, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
 
 
-from models import setup_db, Question, Category
+from admission import init_admission
+import cache
+from compression import compress_response
+from encoding import compact_mimetype, compact_response
+from http_cache import cached_view, add_cache_headers
+from jobs import init_jobs
+import metrics
+from models import setup_db, database_path, replica_path, pool_stats, question_pool, Question, QuestionCount, \
+    Category, QuizSession
+from quiz import is_correct, next_difficulty
+from settings import BULK_CHUNK_SIZE
+from startup import init_startup
+from tenants import init_tenants
+
+logger = logging.getLogger('trivia.api')
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+MAX_BULK_CHUNK_SIZE = 10000
+# random: any difficulty, target: the requested difficulty or the nearest
+# one left, adaptive: harder after a correct answer, easier after a wrong one
+QUIZ_MODES = ('random', 'target', 'adaptive')
+QUIZ_ROUND_SIZE = 5
+MAX_QUIZ_ROUND_SIZE = 50
+MAX_PREVIOUS_QUESTIONS = 10000
+NDJSON = 'application/x-ndjson'
+QUESTION_FIELDS = ['question', 'answer', 'category', 'difficulty']
+BULK_FORMATS = {
+    NDJSON: 'ndjson',
+    'application/json': 'ndjson',
+    'text/csv': 'csv'
+}
+
+
+def buffered(chunks, size=65536):
+    """
+    joins the small strings of a streamed response into chunks of about
+    `size` characters, so that the server is not flushing every row
+    """
+    buffer = io.StringIO()
+    for chunk in chunks:
+        buffer.write(chunk)
+        if buffer.tell() >= size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true') or wants_ndjson()
+
+
+def stream_list(envelope, key, items):
+    """
+    streams `envelope` with the list `items` under `key`, serializing one
+    item at a time. With NDJSON the envelope is the first line and every
+    item follows on its own line.
+    """
+    if wants_ndjson():
+        def generate():
+            yield json.dumps(envelope) + '\n'
+            for item in items:
+                yield json.dumps(item) + '\n'
+
+        return Response(stream_with_context(buffered(generate())), mimetype=NDJSON)
+
+    def generate():
+        yield json.dumps(envelope)[:-1] + (', ' if envelope else '') + json.dumps(key) + ': ['
+        for index, item in enumerate(items):
+            yield (', ' if index else '') + json.dumps(item)
+        yield ']}'
+
+    return Response(stream_with_context(buffered(generate())), mimetype='application/json')
+
+
+def list_response(envelope, key, items, fields):
+    """
+    the envelope with the list `items` under `key`: in the compact encoding
+    the client accepts, streamed when it asks for a stream, or else as one
+    JSON document
+    """
+    mimetype = compact_mimetype()
+    if mimetype:
+        return compact_response(mimetype, envelope, key, list(items), fields)
+    if wants_stream():
+        return stream_list(envelope, key, items)
+    body = dict(envelope)
+    body[key] = items
+    return jsonify(body), 200
+
+
+def get_fields():
+    """
+    keys of the questions asked for with ?fields=question,category, every
+    key of Question.format() by default. The id is always sent, pages and
+    cursors are built on it.
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        return Question.FIELDS
+    fields = set(field.strip() for field in fields.split(',') if field.strip())
+    if fields.difference(Question.FIELDS):
+        abort(400, [{'field': 'fields', 'message': 'fields must be a list of {}'.format(
+            ', '.join(Question.FIELDS))}])
+    return tuple(field for field in Question.FIELDS if field == 'id' or field in fields)
+
+
+def is_integer(value):
+    """an int, or a string of digits as sent by a form or a CSV row, but not a float or a bool"""
+    if isinstance(value, str):
+        return value.strip().isascii() and value.strip().isdigit()
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_question(question, category_ids):
+    """
+    errors of a question sent to POST /questions or in a bulk import; its
+    category is null, for no category, or one of `category_ids`
+    """
+    errors = []
+    for field in QUESTION_FIELDS:
+        if field not in question:
+            errors.append({'field': field, 'message': '{} is required'.format(field)})
+    for field in ('category', 'difficulty'):
+        if question.get(field) is not None and not is_integer(question.get(field)):
+            errors.append({'field': field, 'message': '{} must be an integer'.format(field)})
+    category = question.get('category')
+    if category is not None and is_integer(category) and str(int(category)) not in category_ids:
+        errors.append({'field': 'category', 'message': 'Category with id {} not found'.format(category)})
+    return errors
+
+
+def category_ids():
+    return set(str(category.get('id')) for category in Category.get_categories())
+
+
+def read_bulk_questions(data_format):
+    """
+    yields (line number, question) for every row of the request body, read
+    as a stream. question is None when the row can not be parsed, or is not
+    UTF-8.
+    """
+    invalid = set()
+
+    def decoded():
+        for line_number, line in enumerate(request.stream, 1):
+            try:
+                yield line.decode('utf-8')
+            except UnicodeDecodeError:
+                invalid.add(line_number)
+                yield line.decode('utf-8', 'replace')
+
+    if data_format == 'csv':
+        reader = csv.DictReader(decoded())
+        last_line = 0
+        for question in reader:
+            # a quoted field may span several lines
+            if invalid.intersection(range(last_line + 1, reader.line_num + 1)):
+                question = None
+            else:
+                question = dict((k, v) for k, v in question.items() if k in QUESTION_FIELDS and v != '')
+            last_line = reader.line_num
+            yield reader.line_num, question
+        return
+    for line_number, line in enumerate(decoded(), 1):
+        if line_number in invalid:
+            yield line_number, None
+            continue
+        if not line.strip():
+            continue
+        try:
+            question = json.loads(line)
+        except ValueError:
+            question = None
+        yield line_number, question if isinstance(question, dict) else None
+
+
+def get_quiz_session(data):
+    """
+    the quiz session of the token sent as quiz_session, or a new one, with
+    the previous_questions of the request marked as played
+    """
+    try:
+        previous_questions = [int(pq) for pq in data.get('previous_questions', [])]
+    except (TypeError, ValueError):
+        previous_questions = None
+    if previous_questions is None or len(previous_questions) > MAX_PREVIOUS_QUESTIONS:
+        abort(400, 'Previous questions must be a list of at most {} question ids'.format(MAX_PREVIOUS_QUESTIONS))
+    # questions deleted since, or not yet seen by this worker, can not be drawn anyway
+    previous_questions = [pq for pq in previous_questions if question_pool.contains(pq)]
+    if data.get('quiz_session'):
+        session = QuizSession.get(data.get('quiz_session'))
+        if not session:
+            abort(404, 'Quiz session {} not found'.format(data.get('quiz_session')))
+        for pq in previous_questions:
+            session.seen.add(pq)
+        return session
+    return QuizSession.create(previous_questions)
+
+
+def get_difficulty(data):
+    difficulty = data.get('difficulty')
+    if difficulty is None:
+        return None
+    try:
+        return int(difficulty)
+    except (TypeError, ValueError):
+        abort(400, 'Difficulty must be an integer')
+
+
+def get_page_and_size():
+    page = max(request.args.get('page', 1, type=int), 1)
+    size = min(max(request.args.get('size', QUESTIONS_PER_PAGE, type=int), 1), MAX_QUESTIONS_PER_PAGE)
+    return page, size
+
+
+def encode_cursor(question_id):
+    return base64.urlsafe_b64encode('q:{}'.format(question_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        prefix, question_id = value.split(':', 1)
+        if prefix != 'q':
+            return None
+        return int(question_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    # test_config overrides the settings: DATABASE_URL, DATABASE_REPLICA_URL,
+    # MIGRATE_ON_STARTUP, WARMUP, RATE_LIMITS, CONCURRENCY_LIMITS, TRUSTED_PROXIES,
+    # JOBS_MODE, JOBS_QUEUE_PATH, TENANTS, TENANT_DATABASE_URL, TENANT_HEADER and
+    # MAX_TENANT_ENGINES
+    app.config.from_mapping(test_config or {})
+    setup_db(app, app.config.get('DATABASE_URL', database_path),
+             app.config.get('DATABASE_REPLICA_URL', replica_path))
+    metrics.init_metrics(app)
+    init_tenants(app)
+    init_admission(app)
+    init_jobs(app)
 
     CORS(app)
 
+    @app.before_request
+    def before_request():
+        # reads of GET requests may be served by the read replica
+        g.read_only = request.method in ('GET', 'HEAD')
+
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PATCH, PUT, DELETE, OPTIONS')
-        return response
+        # compression comes once the ETag of the response is known, and the
+        # request is recorded last, with the size of the compressed body
+        return metrics.record_request(compress_response(add_cache_headers(response)))
 
     @app.route('/categories', methods=['GET'])
+    @cached_view('categories', ['categories'])
     def get_categories():
+        if wants_stream():
+            return stream_list({'success': True}, 'categories', Category.get_categories())
         return jsonify({
             'success': True,
             'categories': Category.get_categories(),
 
         }), 200
 
+    @app.route('/stats', methods=['GET'])
+    @cached_view('questions', ['questions', 'categories'])
+    def get_stats():
+        return jsonify(dict(QuestionCount.get_stats(), success=True)), 200
+
+    @app.route('/healthz', methods=['GET'])
+    def get_health():
+        return jsonify({
+            'success': True,
+            'status': 'alive'
+        }), 200
+
+    @app.route('/readyz', methods=['GET'])
+    def get_readiness():
+        startup = app.extensions['startup']
+        if not startup.ready and startup.error:
+            startup.start()
+        return jsonify(dict(startup.status(), success=startup.ready)), 200 if startup.ready else 503
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/db/stats', methods=['GET'])
+    def get_db_stats():
+        return jsonify({
+            'success': True,
+            'pools': pool_stats()
+        }), 200
+
+    @app.route('/jobs/stats', methods=['GET'])
+    def get_jobs_stats():
+        return jsonify({
+            'success': True,
+            'jobs': app.extensions['jobs'].stats()
+        }), 200
+
+    @app.route('/cache/stats', methods=['GET'])
+    def get_cache_stats():
+        return jsonify({
+            'success': True,
+            'caches': cache.stats(),
+            'coalescing': cache.flight_stats()
+        }), 200
+
     """
     Create an endpoint to handle GET requests for questions,
     including pagination (every 10 questions).
@@ -43,20 +345,27 @@ def create_app(test_config=None):
     """
 
     @app.route('/questions', methods=['GET'])
+    @cached_view('questions', ['questions', 'categories'])
     def get_questions():
         categories = Category.get_categories()
-        page = request.args.get('page', 1, type=int)
-        size = request.args.get('size', QUESTIONS_PER_PAGE, type=int)
-        start = (page - 1) * size
-        end = start + size
-        questions = Question.get_questions()
-        return jsonify({
+        page, size = get_page_and_size()
+        fields = get_fields()
+        after = request.args.get('after')
+        if after is not None:
+            after_id = decode_cursor(after)
+            if after_id is None:
+                abort(400, [{'field': 'after', 'message': 'after is not a valid cursor'}])
+            questions = Question.get_questions_after(after_id, size, fields)
+        else:
+            questions = Question.get_questions_page(page, size, fields)
+        envelope = {
             'success': True,
-            'questions': questions[start:end],
-            'current_category': categories[0],
+            'current_category': categories[0] if categories else None,
             'categories': categories,
-            'total_questions': len(questions)
-        }), 200
+            'total_questions': Question.count(),
+            'next_cursor': encode_cursor(questions[-1].get('id')) if len(questions) == size else None
+        }
+        return list_response(envelope, 'questions', questions, fields)
 
     """
     Create an endpoint to DELETE question using a question ID.
@@ -79,6 +388,34 @@ def create_app(test_config=None):
         except Exception as e:
             abort(500, 'Unknown server error ')
 
+    """
+    Deletes the questions of a list of ids, {"ids": [1, 2, 3]}, in one
+    statement. Ids of questions that do not exist are ignored.
+    """
+
+    @app.route('/questions', methods=['DELETE'])
+    def delete_questions():
+        data = request.get_json(silent=True) or {}
+        question_ids = data.get('ids')
+        if not isinstance(question_ids, list) or not question_ids:
+            abort(400, [{'field': 'ids', 'message': 'ids must be a non empty list of question ids'}])
+        if len(question_ids) > MAX_BULK_CHUNK_SIZE:
+            abort(400, [{'field': 'ids', 'message': 'at most {} ids can be deleted at once'.format(
+                MAX_BULK_CHUNK_SIZE)}])
+        try:
+            question_ids = set(int(question_id) for question_id in question_ids)
+        except (TypeError, ValueError):
+            abort(400, [{'field': 'ids', 'message': 'ids must be a non empty list of question ids'}])
+        try:
+            deleted = Question.bulk_delete(sorted(question_ids))
+        except Exception:
+            logger.exception('bulk delete of %s questions failed', len(question_ids))
+            abort(500, 'Unknown server error')
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        }), 200
+
     """
     Create an endpoint to POST a new question,
     which will require the question and answer text,
@@ -91,21 +428,9 @@ def create_app(test_config=None):
     @app.route('/questions', methods=['POST'])
     def create_question():
         question = request.get_json()
-        errors = []
-        if 'question' not in question:
-            errors.append({'field': 'question', 'message': 'question is required'})
-        if 'answer' not in question:
-            errors.append({'field': 'answer', 'message': 'answer is required'})
-        if 'category' not in question:
-            errors.append({'field': 'category', 'message': 'category is required'})
-        if 'difficulty' not in question:
-            errors.append({'field': 'difficulty', 'message': 'difficulty is required'})
+        errors = validate_question(question, category_ids())
         if errors:
             abort(400, errors)
-        if question.get('category'):
-            category = Category.get_category_by_id(question.get('category'))
-            if not category:
-                abort(404, 'Category with id {} not found'.format(question.get('category')))
         try:
             question = Question(**question)
             question.insert()
@@ -117,10 +442,79 @@ def create_app(test_config=None):
             print(e)
             abort(500, 'Unknown server error')
 
+    """
+    Bulk import of questions, streamed as NDJSON (one question per line)
+    or as CSV with a header row. Rows are validated like POST /questions
+    and inserted in chunks; invalid rows are reported and skipped.
+    """
+
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_create_questions():
+        data_format = BULK_FORMATS.get(request.mimetype)
+        if not data_format:
+            abort(415, 'Content type must be one of {}'.format(', '.join(sorted(BULK_FORMATS))))
+        chunk_size = min(max(request.args.get('chunk_size', BULK_CHUNK_SIZE, type=int), 1), MAX_BULK_CHUNK_SIZE)
+        known_category_ids = category_ids()
+        inserted = 0
+        errors = []
+        chunk = []
+        try:
+            for line_number, question in read_bulk_questions(data_format):
+                if question is None:
+                    errors.append({'line': line_number, 'errors': [{'field': None, 'message': 'invalid row'}]})
+                    continue
+                row_errors = validate_question(question, known_category_ids)
+                if row_errors:
+                    errors.append({'line': line_number, 'errors': row_errors})
+                    continue
+                chunk.append(dict((field, int(question.get(field)) if field in ('category', 'difficulty')
+                                   and question.get(field) is not None else question.get(field))
+                                  for field in QUESTION_FIELDS))
+                if len(chunk) >= chunk_size:
+                    inserted += Question.bulk_insert(chunk)
+                    chunk = []
+            inserted += Question.bulk_insert(chunk)
+        except Exception:
+            logger.exception('bulk import failed after %s questions', inserted)
+            abort(500, 'Bulk import failed after {} questions'.format(inserted))
+        # 207 when some rows were rejected, the others being inserted
+        return jsonify({
+            'success': not errors,
+            'inserted': inserted,
+            'errors': errors
+        }), 207 if errors else 201
+
+    @app.route('/questions/export', methods=['GET'])
+    def export_questions():
+        data_format = request.args.get('format', 'ndjson')
+        if data_format not in ('ndjson', 'csv'):
+            abort(400, [{'field': 'format', 'message': 'format must be ndjson or csv'}])
+        fields = ['id'] + QUESTION_FIELDS
+
+        def generate():
+            if data_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(fields)
+                for row in Question.export(BULK_CHUNK_SIZE):
+                    writer.writerow(row)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            else:
+                for row in Question.export(BULK_CHUNK_SIZE):
+                    yield json.dumps(dict(zip(fields, row))) + '\n'
+
+        mimetype = 'text/csv' if data_format == 'csv' else NDJSON
+        return Response(stream_with_context(buffered(generate())), mimetype=mimetype, headers={
+            'Content-Disposition': 'attachment; filename=questions.{}'.format(data_format)
+        })
+
     """
     Create a POST endpoint to get questions based on a search term.
-    It should return any questions for whom the search term
-    is a substring of the question.
+    It should return any questions whose question or answer
+    contains words starting with every word of the search term,
+    best ranked first, paginated like GET /questions.
 
     TEST: Search by any phrase. The questions list will update to include
     only question that include that string within their question.
@@ -131,12 +525,10 @@ def create_app(test_config=None):
     def search_questions_by_term():
         keyword = request.get_json()
         if keyword and 'searchTerm' in keyword:
-            questions = Question.search_question_by_term(keyword.get('searchTerm'))
-            return jsonify({
-                'success': True,
-                'questions': questions,
-                'total_questions': len(questions)
-            }), 200
+            page, size = get_page_and_size()
+            fields = get_fields()
+            questions, total = Question.search_question_by_term(keyword.get('searchTerm'), page, size, fields)
+            return list_response({'success': True, 'total_questions': total}, 'questions', questions, fields)
         else:
             abort(400, [{'field': 'term', 'message': 'term to search is required'}])
 
@@ -150,17 +542,26 @@ def create_app(test_config=None):
     """
 
     @app.route('/categories/<string:category_id>/questions', methods=['GET'])
+    @cached_view('questions', ['questions', 'categories'])
     def get_questions_by_category(category_id):
-        category = Category.get_category_by_id(category_id)
+        fields = get_fields()
+        if wants_stream() and not compact_mimetype():
+            category = Category.get_category_by_id(category_id)
+            if not category:
+                abort(404, 'Category with id {} not found'.format(category_id))
+            return stream_list({
+                'success': True,
+                'current_category': category,
+                'total_questions': Question.count_by_category_id(category_id)
+            }, 'questions', Question.get_questions_by_category_id(category_id, stream=True, fields=fields))
+        category, questions = Question.get_category_and_questions(category_id, fields)
         if not category:
             abort(404, 'Category with id {} not found'.format(category_id))
-        questions = Question.get_questions_by_category_id(category_id)
-        return jsonify({
+        return list_response({
             'success': True,
             'current_category': category,
-            'questions': questions,
-            'total_questions': len(questions)
-        }), 200
+            'total_questions': Question.count_by_category_id(category_id)
+        }, 'questions', questions, fields)
 
     """
     Create a POST endpoint to get questions to play the quiz.
@@ -176,19 +577,98 @@ def create_app(test_config=None):
     @app.route('/quizzes', methods=['POST'])
     def quizzes():
         data = request.get_json()
-        if 'previous_questions' not in data:
-            data.update({'previous_questions': []})
         if 'quiz_category' not in data:
             abort(400, 'Quiz category is required')
-        current_question = Question.get_random_question(data.get('previous_questions'), data.get('quiz_category'))
+        session = get_quiz_session(data)
+        mode = data.get('mode', 'random')
+        if mode not in QUIZ_MODES:
+            abort(400, 'Mode must be one of {}'.format(', '.join(QUIZ_MODES)))
+        difficulty = get_difficulty(data)
+        if mode == 'target' and difficulty is None:
+            abort(400, 'Difficulty is required by the target mode')
+        if mode == 'adaptive':
+            difficulties = question_pool.difficulties((data.get('quiz_category') or {}).get('id'))
+            if session.difficulty is None:
+                # starts at the requested difficulty, else at the easiest one
+                session.difficulty = difficulty or (difficulties[0] if difficulties else None)
+            elif data.get('correct') is not None:
+                session.difficulty = next_difficulty(difficulties, session.difficulty, bool(data.get('correct')))
+            difficulty = session.difficulty
+        elif mode == 'random':
+            difficulty = None
+        current_question = Question.get_random_question(session.seen, data.get('quiz_category'), difficulty)
         if current_question:
-            return jsonify({
-                'question': current_question
-            })
-        else:
-            return jsonify({
-                'question': False
+            session.draw(current_question.get('id'))
+        session.save()
+        return jsonify({
+            'question': current_question or False,
+            'quiz_session': session.token,
+            'difficulty': difficulty
+        })
+
+    """
+    Draws a round of `size` questions (5 by default) in one call, without
+    their answers, which POST /quizzes/answers checks afterwards. Takes the
+    quiz_category, previous_questions, quiz_session and difficulty of
+    POST /quizzes; the questions of the round are marked as played, and
+    drawn for the answers of the quiz session to be checked.
+    """
+
+    @app.route('/quizzes/round', methods=['POST'])
+    def quiz_round():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'quiz_category' not in data:
+            abort(400, 'Quiz category is required')
+        size = data.get('size', QUIZ_ROUND_SIZE)
+        if not isinstance(size, int) or not 0 < size <= MAX_QUIZ_ROUND_SIZE:
+            abort(400, 'Size must be an integer from 1 to {}'.format(MAX_QUIZ_ROUND_SIZE))
+        session = get_quiz_session(data)
+        difficulty = get_difficulty(data)
+        questions = Question.get_random_questions(session.seen, data.get('quiz_category'), size, difficulty)
+        for question in questions:
+            session.draw(question.get('id'))
+        session.save()
+        return jsonify({
+            'success': True,
+            'questions': [dict((key, value) for key, value in question.items() if key != 'answer')
+                          for question in questions],
+            'quiz_session': session.token,
+            'difficulty': difficulty
+        })
+
+    @app.route('/quizzes/answers', methods=['POST'])
+    def check_quiz_answers():
+        data = request.get_json(silent=True) or {}
+        answers = data.get('answers')
+        if not isinstance(answers, list) or not answers or len(answers) > MAX_QUIZ_ROUND_SIZE \
+                or not all(isinstance(answer, dict) and isinstance(answer.get('id'), int) for answer in answers):
+            abort(400, [{'field': 'answers', 'message': 'answers must be a list of at most {} '
+                                                        '{{"id", "answer"}}'.format(MAX_QUIZ_ROUND_SIZE)}])
+        if not data.get('quiz_session'):
+            abort(400, [{'field': 'quiz_session', 'message': 'quiz_session of the round is required'}])
+        session = QuizSession.get(data.get('quiz_session'))
+        if not session:
+            abort(404, 'Quiz session {} not found'.format(data.get('quiz_session')))
+        # only the answers of the questions drawn for the quiz are revealed
+        undrawn = [answer.get('id') for answer in answers if answer.get('id') not in session.drawn]
+        if undrawn:
+            abort(400, [{'field': 'answers', 'message': 'questions {} were not drawn in this quiz session'.format(
+                ', '.join(str(question_id) for question_id in undrawn))}])
+        questions = dict((question.get('id'), question)
+                         for question in Question.get_questions_by_ids([answer.get('id') for answer in answers]))
+        results = []
+        for answer in answers:
+            expected = questions.get(answer.get('id'), {}).get('answer')
+            results.append({
+                'id': answer.get('id'),
+                'correct': expected is not None and is_correct(answer.get('answer', ''), expected),
+                'answer': expected
             })
+        return jsonify({
+            'success': True,
+            'results': results,
+            'score': len([result for result in results if result.get('correct')])
+        })
 
     @app.errorhandler(404)
     def resource_not_found(error):
@@ -220,6 +700,36 @@ def create_app(test_config=None):
             'path': request.full_path or ''
         }), 400
 
+    @app.errorhandler(415)
+    def unsupported_media_type(error):
+        return jsonify({
+            'success': False,
+            'error': 415,
+            'message': error.description or '',
+            'timestamp': datetime.now(),
+            'path': request.full_path or ''
+        }), 415
+
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify({
+            'success': False,
+            'error': 429,
+            'message': error.description or '',
+            'timestamp': datetime.now(),
+            'path': request.full_path or ''
+        }), 429, {'Retry-After': str(g.get('retry_after', 1))}
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            'success': False,
+            'error': 503,
+            'message': error.description or '',
+            'timestamp': datetime.now(),
+            'path': request.full_path or ''
+        }), 503, {'Retry-After': str(g.get('retry_after', 1))}
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return jsonify({
@@ -230,4 +740,6 @@ def create_app(test_config=None):
             'path': request.full_path or ''
         }), 500
 
+    # warms the new worker up once it is fully configured
+    init_startup(app)
     return app
@@ -0,0 +1,46 @@
+import functools
+import hashlib
+
+from flask import current_app, g, request
+
+from models import DataVersion
+from settings import CACHE_CONTROL, TENANT_HEADER
+
+"""
+cached_view(route, tables)
+    decorator of the read endpoints. The ETag of a response is derived from
+    the versions the database keeps of the tables the endpoint reads, which
+    every write bumps in its transaction, so a matching If-None-Match is
+    answered with 304 after a single query, by any worker. Tenants never
+    share an ETag.
+    `route` picks the Cache-Control header of the response in CACHE_CONTROL.
+"""
+
+
+def cached_view(route, tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = DataVersion.get_versions()
+            key = '{}|{}|{}|{}'.format(g.get('tenant', ''), ','.join(str(versions.get(table)) for table in tables),
+                                       request.full_path, request.accept_mimetypes)
+            g.etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+            g.cache_control = CACHE_CONTROL.get(route)
+            if request.if_none_match.contains_weak(g.etag):
+                return '', 304
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_cache_headers(response):
+    if g.get('etag') and response.status_code in (200, 304):
+        response.set_etag(g.etag, weak=True)
+        if g.cache_control:
+            response.headers['Cache-Control'] = g.cache_control
+        response.vary.add('Accept')
+        if g.get('tenant'):
+            response.vary.add(current_app.config.get('TENANT_HEADER', TENANT_HEADER))
+    return response
@@ -0,0 +1,341 @@
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+
+import metrics
+from settings import JOBS_MODE, JOBS_WORKERS, JOBS_QUEUE_SIZE, JOBS_MAX_ATTEMPTS, JOBS_RETRY_DELAY, \
+    JOBS_QUEUE_PATH, JOBS_DRAIN_TIMEOUT
+from tenants import current_tenant
+
+logger = logging.getLogger('trivia.jobs')
+
+executed = metrics.Counter('trivia_jobs_total', 'Jobs run in the background, by outcome.', ('job', 'outcome'))
+metrics.counters.append(executed)
+
+# functions run by the jobs, by name
+registry = {}
+# names of the jobs working on the memory of the worker queuing them
+local_jobs = set()
+
+# jobs of the last app created, for the writes made outside of an app context
+runner = None
+
+
+def job(name, local=False):
+    """
+    registers the decorated function as the job `name`, its arguments must
+    be JSON. A local job, such as the reload of the caches of the worker,
+    runs in the worker queuing it and is not kept across restarts.
+    """
+    def decorator(function):
+        registry[name] = function
+        if local:
+            local_jobs.add(name)
+        else:
+            local_jobs.discard(name)
+        return function
+
+    return decorator
+
+
+def backoff(attempts, delay=JOBS_RETRY_DELAY):
+    """seconds before the next attempt of a job which failed `attempts` times"""
+    return delay * 2 ** (attempts - 1)
+
+
+class QueueFull(Exception):
+    pass
+
+
+"""
+MemoryQueue
+    bounded queue of the jobs of the worker, handed out by the time they
+    are due. The jobs it holds are lost when the worker stops.
+"""
+
+
+class MemoryQueue(object):
+
+    def __init__(self, size):
+        self.size = size
+        self._jobs = []
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, name, args, tenant=None):
+        with self._condition:
+            if len(self._jobs) >= self.size:
+                raise QueueFull()
+            heapq.heappush(self._jobs, (time.time(), next(self._ids), name, args, 0, tenant))
+            self._condition.notify()
+
+    def get(self, timeout):
+        """the next job due as (id, name, args, attempts, tenant), None when none is due within `timeout`"""
+        deadline = time.time() + timeout
+        with self._condition:
+            while not self._closed:
+                now = time.time()
+                if self._jobs and self._jobs[0][0] <= now:
+                    _, job_id, name, args, attempts, tenant = heapq.heappop(self._jobs)
+                    return job_id, name, args, attempts, tenant
+                if now >= deadline:
+                    return None
+                self._condition.wait(min(deadline, self._jobs[0][0]) - now if self._jobs else deadline - now)
+        return None
+
+    def done(self, job):
+        pass
+
+    def retry(self, job, attempts, run_at):
+        # admitted once already, a retry may go over the size
+        job_id, name, args, _, tenant = job
+        with self._condition:
+            heapq.heappush(self._jobs, (run_at, job_id, name, args, attempts, tenant))
+            self._condition.notify()
+
+    def due(self):
+        now = time.time()
+        return len([job for job in self._jobs if job[0] <= now])
+
+    def close(self):
+        """wakes the threads waiting for a job up, get() returns None from now on"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        return len(self._jobs)
+
+
+"""
+SQLiteQueue
+    bounded queue of jobs kept in a local SQLite file, which outlives the
+    worker and is shared by the workers of the host. A job is leased to the
+    worker running it; the job of a worker stopped before it was done is
+    handed out again once the lease is over.
+"""
+
+
+class SQLiteQueue(object):
+    LEASE = 300
+    # seconds between two looks for the jobs queued by the other workers
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._local = threading.local()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._connection().execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+                                   'args TEXT NOT NULL, attempts INTEGER NOT NULL, run_at REAL NOT NULL, '
+                                   'leased_until REAL, tenant TEXT)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def put(self, name, args, tenant=None):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if connection.execute('SELECT count(*) FROM jobs').fetchone()[0] >= self.size:
+                raise QueueFull()
+            connection.execute('INSERT INTO jobs (name, args, attempts, run_at, tenant) VALUES (?, ?, 0, ?, ?)',
+                               (name, json.dumps(args), time.time(), tenant))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        with self._condition:
+            self._condition.notify()
+
+    def _lease(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = connection.execute('SELECT id, name, args, attempts, tenant FROM jobs WHERE run_at <= ? '
+                                     'AND (leased_until IS NULL OR leased_until <= ?) ORDER BY run_at, id LIMIT 1',
+                                     (now, now)).fetchone()
+            if row:
+                connection.execute('UPDATE jobs SET leased_until = ? WHERE id = ?', (now + self.LEASE, row[0]))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return (row[0], row[1], json.loads(row[2]), row[3], row[4]) if row else None
+
+    def get(self, timeout):
+        deadline = time.time() + timeout
+        while not self._closed:
+            job = self._lease()
+            now = time.time()
+            if job or now >= deadline:
+                return job
+            with self._condition:
+                self._condition.wait(min(self.POLL_INTERVAL, deadline - now))
+        return None
+
+    def done(self, job):
+        self._connection().execute('DELETE FROM jobs WHERE id = ?', (job[0],))
+
+    def retry(self, job, attempts, run_at):
+        self._connection().execute('UPDATE jobs SET attempts = ?, run_at = ?, leased_until = NULL WHERE id = ?',
+                                   (attempts, run_at, job[0]))
+        with self._condition:
+            self._condition.notify()
+
+    def due(self):
+        now = time.time()
+        return self._connection().execute('SELECT count(*) FROM jobs WHERE run_at <= ? '
+                                          'AND (leased_until IS NULL OR leased_until <= ?)', (now, now)).fetchone()[0]
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __len__(self):
+        return self._connection().execute('SELECT count(*) FROM jobs').fetchone()[0]
+
+
+"""
+Jobs
+    runs the jobs queued by the writes of an app in `workers` threads,
+    retrying a failing job with an exponential backoff up to `max_attempts`
+    times. A job runs for the tenant of the request which queued it. A
+    request queuing a job into a full queue runs it itself. The local jobs
+    go to `local_queue`, a queue of the worker, when `queue` is shared.
+    drain() is called when the worker stops: it lets the threads run the
+    jobs already due for at most JOBS_DRAIN_TIMEOUT seconds.
+"""
+
+
+class Jobs(object):
+
+    def __init__(self, app, queue, mode=JOBS_MODE, workers=JOBS_WORKERS, max_attempts=JOBS_MAX_ATTEMPTS,
+                 retry_delay=JOBS_RETRY_DELAY, local_queue=None):
+        self.app = app
+        self.queue = queue
+        self.local_queue = local_queue if local_queue is not None else queue
+        self.mode = mode
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self.mode != 'background' or self._threads:
+            return
+        threads = [(self.queue, 'trivia-jobs-{}'.format(index)) for index in range(self.workers)]
+        if self.local_queue is not self.queue:
+            threads.append((self.local_queue, 'trivia-jobs-local'))
+        for queue, name in threads:
+            thread = threading.Thread(target=self._work, args=(queue,), name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.drain)
+
+    def _queues(self):
+        return [self.queue] if self.local_queue is self.queue else [self.queue, self.local_queue]
+
+    def enqueue(self, name, *args):
+        if name not in registry:
+            raise ValueError('Unknown job {}'.format(name))
+        tenant = current_tenant()
+        if self.mode == 'eager' or self._stopping.is_set():
+            self._call(name, args, tenant)
+            return
+        try:
+            (self.local_queue if name in local_jobs else self.queue).put(name, list(args), tenant)
+        except QueueFull:
+            executed.inc(name, 'inline')
+            self._call(name, args, tenant)
+
+    def _call(self, name, args, tenant=None):
+        if has_app_context() and current_app._get_current_object() is self.app and current_tenant() == tenant:
+            registry[name](*args)
+            return
+        with self.app.app_context():
+            if tenant:
+                g.tenant = tenant
+            registry[name](*args)
+
+    def _work(self, queue):
+        while not self._stopping.is_set():
+            job = queue.get(timeout=0.5)
+            if job:
+                self.run(job, queue)
+
+    def run(self, job, queue=None):
+        queue = self.queue if queue is None else queue
+        _, name, args, attempts, tenant = job
+        try:
+            self._call(name, args, tenant)
+        except Exception:
+            attempts += 1
+            if attempts >= self.max_attempts or name not in registry:
+                logger.exception('job %s failed %s times, dropped', name, attempts)
+                queue.done(job)
+                executed.inc(name, 'failed')
+            else:
+                logger.warning('job %s failed, attempt %s of %s', name, attempts, self.max_attempts, exc_info=True)
+                queue.retry(job, attempts, time.time() + backoff(attempts, self.retry_delay))
+                executed.inc(name, 'retried')
+            return
+        queue.done(job)
+        executed.inc(name, 'done')
+
+    def drain(self, timeout=JOBS_DRAIN_TIMEOUT):
+        deadline = time.time() + timeout
+        while self._threads and not self._stopping.is_set() and time.time() < deadline \
+                and any(queue.due() for queue in self._queues()):
+            time.sleep(0.05)
+        self._stopping.set()
+        for queue in self._queues():
+            queue.close()
+        for thread in self._threads:
+            thread.join(max(deadline - time.time(), 0))
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'workers': len(self._threads),
+            'queued': sum(len(queue) for queue in self._queues())
+        }
+
+
+def enqueue(name, *args):
+    """queues the job `name` with the jobs of the current app, or else of the last app created"""
+    jobs = current_app.extensions.get('jobs') if has_app_context() else runner
+    if jobs is None:
+        # no app to run it in the background
+        registry[name](*args)
+        return
+    jobs.enqueue(name, *args)
+
+
+def init_jobs(app):
+    global runner
+    path = app.config.get('JOBS_QUEUE_PATH', JOBS_QUEUE_PATH)
+    queue = SQLiteQueue(path, JOBS_QUEUE_SIZE) if path else MemoryQueue(JOBS_QUEUE_SIZE)
+    # the local jobs stay with the worker queuing them
+    local_queue = MemoryQueue(JOBS_QUEUE_SIZE) if path else queue
+    jobs = runner = app.extensions['jobs'] = Jobs(app, queue, app.config.get('JOBS_MODE', JOBS_MODE),
+                                                  local_queue=local_queue)
+    jobs.start()
+    return jobs
@@ -0,0 +1,216 @@
+import logging
+import threading
+import time
+
+from flask import g, request, has_request_context
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import cache
+from models import pool_stats
+from settings import SERVER_TIMING, SLOW_QUERY_MS
+from tenants import current_tenant
+
+logger = logging.getLogger('trivia.sql')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def format_labels(names, values, extra=()):
+    # an empty value, such as the tenant of a single tenant process, is left out
+    pairs = [(name, value) for name, value in list(zip(names, values)) + list(extra) if value != '']
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+"""
+Histogram
+    Prometheus histogram, one series of cumulative buckets per label values
+"""
+
+
+class Histogram(object):
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name, format_labels(self.labels, label_values, [('le', bound)]), count))
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(self.labels, label_values, [('le', '+Inf')]), series['count']))
+                lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labels, label_values), series['sum']))
+                lines.append('{}_count{} {}'.format(
+                    self.name, format_labels(self.labels, label_values), series['count']))
+        return lines
+
+
+"""
+Counter
+    Prometheus counter, one value per label values
+"""
+
+
+class Counter(object):
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, **kwargs):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + kwargs.get('amount', 1)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(self.name, format_labels(self.labels, label_values), value))
+        return lines
+
+
+def gauge(name, help, samples):
+    """renders a gauge computed at scrape time from (labels, value) samples"""
+    lines = ['# HELP {} {}'.format(name, help), '# TYPE {} gauge'.format(name)]
+    for labels, value in samples:
+        lines.append('{}{} {}'.format(name, format_labels([], [], labels), value))
+    return lines
+
+
+REQUEST_LABELS = ('method', 'route', 'status', 'tenant')
+
+request_duration = Histogram('trivia_request_duration_seconds', 'Time spent handling a request.',
+                             LATENCY_BUCKETS, REQUEST_LABELS)
+response_size = Histogram('trivia_response_size_bytes', 'Size of the response body, once compressed.',
+                          SIZE_BUCKETS, REQUEST_LABELS)
+request_queries = Histogram('trivia_request_sql_queries', 'SQL statements run by a request.',
+                            COUNT_BUCKETS, ('method', 'route', 'tenant'))
+request_sql_duration = Histogram('trivia_request_sql_duration_seconds', 'Time spent in SQL by a request.',
+                                 LATENCY_BUCKETS, ('method', 'route', 'tenant'))
+serialization_duration = Histogram('trivia_serialization_duration_seconds', 'Time spent encoding JSON by a request.',
+                                   LATENCY_BUCKETS, ('method', 'route', 'tenant'))
+sql_duration = Histogram('trivia_sql_duration_seconds', 'Time spent running one SQL statement.', LATENCY_BUCKETS)
+slow_queries = Counter('trivia_sql_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS.')
+
+histograms = [request_duration, response_size, request_queries, request_sql_duration, serialization_duration,
+              sql_duration]
+counters = [slow_queries]
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    sql_duration.observe(elapsed)
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_time += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc()
+        logger.warning('slow query (%.1f ms): %s', elapsed * 1000, statement)
+
+
+"""
+TimedJSONEncoder
+    JSON encoder of the app, adding the time spent encoding to the request
+"""
+
+
+class TimedJSONEncoder(JSONEncoder):
+
+    def encode(self, o):
+        started = time.perf_counter()
+        try:
+            return super(TimedJSONEncoder, self).encode(o)
+        finally:
+            if has_request_context() and 'serialization_time' in g:
+                g.serialization_time += time.perf_counter() - started
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_time = 0.0
+    g.serialization_time = 0.0
+
+
+def record_request(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    tenant = current_tenant() or ''
+    request_duration.observe(elapsed, request.method, route, response.status_code, tenant)
+    if not response.is_streamed:
+        response_size.observe(response.calculate_content_length() or 0, request.method, route,
+                              response.status_code, tenant)
+    request_queries.observe(g.sql_queries, request.method, route, tenant)
+    request_sql_duration.observe(g.sql_time, request.method, route, tenant)
+    serialization_duration.observe(g.serialization_time, request.method, route, tenant)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = 'db;dur={:.2f};desc="{} queries", serialize;dur={:.2f}, ' \
+                                            'total;dur={:.2f}'.format(g.sql_time * 1000, g.sql_queries,
+                                                                      g.serialization_time * 1000, elapsed * 1000)
+    return response
+
+
+def init_metrics(app):
+    app.json_encoder = TimedJSONEncoder
+    app.before_request(start_request)
+
+
+def render():
+    lines = []
+    for metric in histograms + counters:
+        lines.extend(metric.render())
+    cache_stats = cache.stats()
+    lines.extend(gauge('trivia_cache_hits', 'Hits of the read caches of the worker.',
+                       [([('cache', name)], stats.get('hits', 0)) for name, stats in sorted(cache_stats.items())]))
+    lines.extend(gauge('trivia_cache_misses', 'Misses of the read caches of the worker.',
+                       [([('cache', name)], stats.get('misses', 0)) for name, stats in sorted(cache_stats.items())]))
+    flight_stats = sorted(cache.flight_stats().items())
+    for key, help in (('calls', 'Queries run by the coalesced reads of the worker.'),
+                      ('shared', 'Calls of the coalesced reads served by a query already in flight.'),
+                      ('hits', 'Calls of the coalesced reads served by their micro-cache.'),
+                      ('ratio', 'Share of the calls of the coalesced reads served without a query.')):
+        lines.extend(gauge('trivia_coalesced_{}'.format(key), help,
+                           [([('read', name)], stats[key]) for name, stats in flight_stats]))
+    for key, help in (('checked_out', 'Connections in use.'), ('checked_in', 'Idle connections of the pool.'),
+                      ('overflow', 'Connections opened beyond the pool size.'),
+                      ('checkouts', 'Connections handed out by the pool.'),
+                      ('checkout_wait_seconds', 'Time spent waiting for a pooled connection.')):
+        samples = [([('database', name)], stats[key]) for name, stats in sorted(pool_stats().items()) if key in stats]
+        lines.extend(gauge('trivia_db_pool_{}'.format(key), help, samples))
+    return '\n'.join(lines) + '\n'
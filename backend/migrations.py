@@ -0,0 +1,177 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table, inspect, text
+
+from search import CREATE_SEARCH_INDEX
+
+# fills question_counts from the questions, 0 standing for no category or
+# no difficulty
+COUNT_QUESTIONS = 'INSERT INTO question_counts (category, difficulty, total) ' \
+                  'SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*) FROM questions ' \
+                  'GROUP BY coalesce(category, 0), coalesce(difficulty, 0)'
+
+# key of the Postgres advisory lock held while migrating, any constant
+# shared by all the workers does
+LOCK_KEY = 7497826
+
+"""
+Migrations
+    versioned changes of the schema, applied in order by migrate() and
+    recorded in the schema_version table. Each one runs once per database
+    and must cope with the databases created before migrations existed:
+    from trivia.psql, whose questions.category is already an integer
+    foreign key, or by create_all(), whose questions.category is a string.
+"""
+
+
+def create_tables(connection):
+    metadata = MetaData()
+    Table('categories', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('type', String))
+    Table('questions', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('question', String),
+          Column('answer', String),
+          Column('category', String),
+          Column('difficulty', Integer))
+    metadata.create_all(connection, checkfirst=True)
+
+
+def integer_category(connection):
+    """
+    turns questions.category into an integer foreign key to categories.id,
+    questions whose category does not exist are left without a category
+    """
+    inspector = inspect(connection)
+    columns = dict((column['name'], column) for column in inspector.get_columns('questions'))
+    is_integer = isinstance(columns['category']['type'], Integer)
+    has_foreign_key = any(foreign_key['constrained_columns'] == ['category']
+                          for foreign_key in inspector.get_foreign_keys('questions'))
+    if is_integer and has_foreign_key:
+        return
+    if connection.dialect.name == 'sqlite':
+        # SQLite cannot alter a column, the table is copied instead
+        connection.execute(text(
+            'CREATE TABLE questions_migrated ('
+            'id INTEGER NOT NULL PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+            'category INTEGER REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL, difficulty INTEGER)'))
+        connection.execute(text(
+            'INSERT INTO questions_migrated (id, question, answer, category, difficulty) '
+            'SELECT id, question, answer, (SELECT categories.id FROM categories '
+            'WHERE CAST(categories.id AS TEXT) = CAST(questions.category AS TEXT)), difficulty FROM questions'))
+        connection.execute(text('DROP TABLE questions'))
+        connection.execute(text('ALTER TABLE questions_migrated RENAME TO questions'))
+        return
+    if is_integer:
+        connection.execute(text(
+            'UPDATE questions SET category = NULL WHERE category NOT IN (SELECT id FROM categories)'))
+    else:
+        connection.execute(text(
+            'UPDATE questions SET category = NULL '
+            'WHERE category NOT IN (SELECT CAST(id AS VARCHAR) FROM categories)'))
+        connection.execute(text(
+            'ALTER TABLE questions ALTER COLUMN category TYPE INTEGER USING CAST(category AS INTEGER)'))
+    connection.execute(text(
+        'ALTER TABLE questions ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category) '
+        'REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL'))
+
+
+def question_indexes(connection):
+    # (category, id) serves the category pages, ordered by id, and counts
+    connection.execute(text('CREATE INDEX IF NOT EXISTS questions_category_id_idx ON questions (category, id)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS questions_difficulty_idx ON questions (difficulty)'))
+
+
+def search_index(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(CREATE_SEARCH_INDEX))
+
+
+def question_counts(connection):
+    connection.execute(text(
+        'CREATE TABLE question_counts (category INTEGER NOT NULL, difficulty INTEGER NOT NULL, '
+        'total INTEGER NOT NULL, PRIMARY KEY (category, difficulty))'))
+    connection.execute(text(COUNT_QUESTIONS))
+
+
+def data_versions(connection):
+    connection.execute(text(
+        'CREATE TABLE data_versions (name VARCHAR NOT NULL PRIMARY KEY, version INTEGER NOT NULL)'))
+    connection.execute(text("INSERT INTO data_versions (name, version) VALUES ('questions', 0), ('categories', 0)"))
+
+
+def quiz_sessions(connection):
+    connection.execute(text(
+        'CREATE TABLE quiz_sessions (token VARCHAR NOT NULL PRIMARY KEY, seen TEXT NOT NULL, drawn TEXT NOT NULL, '
+        'difficulty INTEGER, expires_at FLOAT NOT NULL)'))
+    connection.execute(text('CREATE INDEX quiz_sessions_expires_at_idx ON quiz_sessions (expires_at)'))
+
+
+MIGRATIONS = [
+    (1, 'create tables', create_tables),
+    (2, 'integer foreign key for questions.category', integer_category),
+    (3, 'indexes of questions', question_indexes),
+    (4, 'full text search index of questions', search_index),
+    (5, 'questions counted per category and difficulty', question_counts),
+    (6, 'versions of the questions and categories', data_versions),
+    (7, 'quiz sessions', quiz_sessions)
+]
+
+
+def lock(connection):
+    """
+    takes a lock held until the end of the transaction, so that workers
+    starting together migrate one after the other
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), key=LOCK_KEY)
+    elif connection.dialect.name == 'sqlite':
+        connection.execute(text('BEGIN EXCLUSIVE'))
+
+
+def current_version(connection):
+    return connection.execute(text('SELECT max(version) FROM schema_version')).scalar() or 0
+
+
+"""
+migrate(engine)
+    applies the migrations the database has not seen yet, in a single
+    transaction, and returns the version of the schema. Safe to run from
+    every worker at startup: the first one migrates while holding the lock,
+    the others wait for it and then find nothing left to do.
+"""
+
+
+def migrate(engine, migrations=MIGRATIONS):
+    with engine.connect() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            # pysqlite begins transactions lazily and never before DDL, so
+            # the exclusive transaction is begun by lock() instead
+            connection.connection.isolation_level = None
+        try:
+            with connection.begin():
+                lock(connection)
+                connection.execute(text(
+                    'CREATE TABLE IF NOT EXISTS schema_version '
+                    '(version INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP)'))
+                version = current_version(connection)
+                for migration_version, name, upgrade in migrations:
+                    if migration_version <= version:
+                        continue
+                    upgrade(connection)
+                    connection.execute(text(
+                        'INSERT INTO schema_version (version, name, applied_at) '
+                        'VALUES (:version, :name, CURRENT_TIMESTAMP)'), version=migration_version, name=name)
+                    version = migration_version
+        finally:
+            if sqlite:
+                connection.connection.isolation_level = ''
+    return version
+
+
+if __name__ == '__main__':
+    # migrates the database of the settings ahead of a deployment
+    from sqlalchemy import create_engine
+    from models import database_path
+
+    print('schema version {}'.format(migrate(create_engine(database_path))))
@@ -1,25 +1,329 @@
+import csv
+import functools
+import io
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
-import random
-from settings import DB_NAME, DB_USER, DB_PASSWORD
+import secrets
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from flask import g, has_request_context
+from sqlalchemy import Column, ForeignKey, Index, String, Integer, create_engine, func, literal_column, orm, text
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+import threading
+from settings import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DATABASE_URL, DATABASE_REPLICA_URL, DB_POOL_SIZE, \
+    DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT, QUESTION_CACHE_TTL, \
+    CATEGORY_CACHE_TTL, STREAM_CHUNK_SIZE, QUIZ_QUESTION_CACHE_SIZE, MIGRATE_ON_STARTUP, COALESCE_READS, COALESCE_TTL, \
+    QUIZ_SESSION_TTL
+from settings import TENANTS, TENANT_DATABASE_URL, MAX_TENANT_ENGINES, TENANT_POOL_SIZE, TENANT_MAX_OVERFLOW
+import cache
+from cache import get_cache, get_flight
+from quiz import FormattedQuestions, QuestionPool, SeenSet
+from migrations import COUNT_QUESTIONS, migrate
+from search import InvertedIndex, SEARCH_DOCUMENT, tokenize, to_tsquery
+from tenants import TenantLocal, current_tenant, drop_tenant, namespaced
+
+database_path = DATABASE_URL or 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
+replica_path = DATABASE_REPLICA_URL
 
-database_path = 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, 'localhost:5432', DB_NAME)
+"""
+TimedQueuePool
+    QueuePool recording how long requests wait to check a connection out
+"""
+
+
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_wait = 0.0
+        self.max_checkout_wait = 0.0
 
-db = SQLAlchemy()
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.checkout_wait += waited
+            self.max_checkout_wait = max(self.max_checkout_wait, waited)
+
+
+"""
+RoutingSession
+    session sending the statements of a tenant to the database of the
+    tenant, and the reads of GET requests to the read replica, when one is
+    configured. Flushes always go to the primary database.
+"""
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        tenant = current_tenant()
+        if tenant and 'tenant_engines' in self.app.extensions:
+            return self.app.extensions['tenant_engines'].get(tenant)
+        if not self._flushing and has_request_context() and g.get('read_only') \
+                and 'replica' in self.app.config['SQLALCHEMY_BINDS']:
+            return db.get_engine(self.app, bind='replica')
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+"""
+RoutingSQLAlchemy
+    SQLAlchemy service opening RoutingSessions. The apps of a process share
+    the engine, and so the pool, of a database URL: an in-memory SQLite
+    database is the same for every app created by the tests.
+"""
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, *args, **kwargs):
+        super(RoutingSQLAlchemy, self).__init__(*args, **kwargs)
+        self.engines = {}
+        self._engines_lock = threading.Lock()
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        with self._engines_lock:
+            if str(sa_url) not in self.engines:
+                self.engines[str(sa_url)] = super(RoutingSQLAlchemy, self).create_engine(sa_url, engine_opts)
+            return self.engines[str(sa_url)]
+
+
+db = RoutingSQLAlchemy()
+
+category_cache = get_cache('categories', CATEGORY_CACHE_TTL)
+question_cache = get_cache('questions', QUESTION_CACHE_TTL)
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, and brings the
+    schema of the database up to date
 """
 
 
-def setup_db(app, database_path=database_path):
+def engine_options(database_path, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    if database_path.startswith('sqlite'):
+        # SQLite connections are not pooled, Flask-SQLAlchemy picks its pool
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+    if database_path.startswith('postgresql') and DB_STATEMENT_TIMEOUT:
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(DB_STATEMENT_TIMEOUT)}
+    return options
+
+
+def setup_db(app, database_path=database_path, replica_path=replica_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = {'replica': replica_path} if replica_path else {}
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
-    db.create_all()
+    migrate_on_startup = app.config.get('MIGRATE_ON_STARTUP', MIGRATE_ON_STARTUP)
+    if app.config.get('TENANTS', TENANTS):
+        # the databases of the tenants are opened, and migrated, on first use
+        app.extensions['tenant_engines'] = TenantEngines(
+            partial(create_tenant_engine, app.config.get('TENANT_DATABASE_URL', TENANT_DATABASE_URL),
+                    migrate_on_startup),
+            app.config.get('MAX_TENANT_ENGINES', MAX_TENANT_ENGINES))
+    elif migrate_on_startup:
+        migrate(db.engine)
+
+
+def create_tenant_engine(database_url, migrate_on_startup, tenant):
+    url = database_url.format(tenant=tenant)
+    engine = create_engine(url, **engine_options(url, TENANT_POOL_SIZE, TENANT_MAX_OVERFLOW))
+    if migrate_on_startup:
+        migrate(engine)
+    return engine
+
+
+"""
+TenantEngines
+    engines of the tenants of an app, created by `create(tenant)` on first
+    use. Beyond `size` engines, the least recently used ones without a
+    connection checked out are disposed of, along with the in-memory
+    question pools of their tenants. An engine is created, and its
+    database migrated, under a lock of its tenant only, so that the
+    requests of the other tenants do not wait for it.
+"""
+
+
+class TenantEngines(object):
+
+    def __init__(self, create, size=MAX_TENANT_ENGINES):
+        self.create = create
+        self.size = size
+        self.evictions = 0
+        self._engines = OrderedDict()
+        self._creating = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, tenant):
+        with self._lock:
+            engine = self._engines.get(tenant)
+            if engine is not None:
+                self._engines.move_to_end(tenant)
+                return engine, None
+            # kept once created: the tenants of an app are a fixed set
+            if tenant not in self._creating:
+                self._creating[tenant] = threading.Lock()
+            return None, self._creating[tenant]
+
+    def get(self, tenant):
+        engine, creating = self._lookup(tenant)
+        if engine is not None:
+            return engine
+        with creating:
+            # another request may have created it while this one waited
+            engine, _ = self._lookup(tenant)
+            if engine is None:
+                engine = self.create(tenant)
+                with self._lock:
+                    self._engines[tenant] = engine
+                    self._evict()
+            return engine
+
+    def _evict(self):
+        # the engine just created is the last one, and is never evicted
+        for tenant, engine in list(self._engines.items())[:-1]:
+            if len(self._engines) <= self.size:
+                return
+            if isinstance(engine.pool, QueuePool) and engine.pool.checkedout():
+                continue
+            del self._engines[tenant]
+            engine.dispose()
+            drop_tenant(tenant)
+            self.evictions += 1
+
+    def items(self):
+        with self._lock:
+            return list(self._engines.items())
+
+
+"""
+pool_stats()
+    sizing and usage of the connection pool of the primary database, of
+    the read replica and of the open tenant databases
+"""
+
+
+def pool_stats():
+    app = db.get_app()
+    engines = []
+    for name, bind in (('primary', None), ('replica', 'replica')):
+        if not bind or bind in app.config['SQLALCHEMY_BINDS']:
+            engines.append((name, db.get_engine(app, bind=bind)))
+    if 'tenant_engines' in app.extensions:
+        engines.extend(('tenant:{}'.format(tenant), engine)
+                       for tenant, engine in app.extensions['tenant_engines'].items())
+    stats = {}
+    for name, engine in engines:
+        pool = engine.pool
+        stats[name] = {'pool': type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            stats[name].update({
+                'size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0)
+            })
+        if isinstance(pool, TimedQueuePool):
+            stats[name].update({
+                'checkouts': pool.checkouts,
+                'checkout_wait_seconds': pool.checkout_wait,
+                'max_checkout_wait_seconds': pool.max_checkout_wait
+            })
+    return stats
+
+
+"""
+transaction()
+    unit of work of the models: the writes of the block are committed
+    together when it ends, or all rolled back when it raises. Blocks nest,
+    only the outermost one commits. Callbacks registered with after_commit()
+    run once the commit succeeded, so caches never see uncommitted writes.
+"""
+
+
+@contextmanager
+def transaction():
+    info = db.session.info
+    depth = info.get('transaction_depth', 0)
+    if not depth:
+        info['after_commit'] = []
+    info['transaction_depth'] = depth + 1
+    try:
+        yield db.session
+        if not depth:
+            db.session.commit()
+    except Exception:
+        if not depth:
+            db.session.rollback()
+            info.pop('after_commit', None)
+        raise
+    finally:
+        info['transaction_depth'] = depth
+    if not depth:
+        for callback in info.pop('after_commit', []):
+            callback()
+
+
+def after_commit(callback):
+    if db.session.info.get('transaction_depth'):
+        db.session.info['after_commit'].append(callback)
+    else:
+        callback()
+
+
+"""
+coalesced(*caches)
+    decorator of the read classmethods: concurrent calls with the same
+    arguments, for the same tenant and versions of `caches`, share one query
+    through the SingleFlight of the method. Reads within a transaction()
+    run on their own, they must see its writes.
+"""
+
+
+def coalesced(*caches):
+    def decorator(function):
+        flight = get_flight(function.__qualname__, COALESCE_TTL)
+
+        @functools.wraps(function)
+        def wrapper(cls, *args, **kwargs):
+            if not COALESCE_READS or db.session.info.get('transaction_depth'):
+                return function(cls, *args, **kwargs)
+            key = '{}|{}|{!r}|{!r}'.format(namespaced(''), ','.join(str(versioned.version()) for versioned in caches),
+                                           args, sorted(kwargs.items()))
+            return flight.do(key, partial(function, cls, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+def warm_caches_later():
+    """
+    queues the reload of the caches a write invalidated as a whole, so that
+    the next reader does not pay for it
+    """
+    # imported here, jobs.py imports the metrics, which import the models
+    from jobs import enqueue
+    enqueue('warm_caches')
 
 
 """
@@ -30,11 +334,14 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # created by migrations.py, declared here so that the model lists them
+    __table_args__ = (Index('questions_category_id_idx', 'category', 'id'),
+                      Index('questions_difficulty_idx', 'difficulty'))
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -44,21 +351,41 @@ class Question(db.Model):
         self.difficulty = difficulty
 
     def insert(self):
-        db.session.add(self)
-        db.session.commit()
+        with transaction():
+            db.session.add(self)
+            db.session.flush()
+            question = self.format()
+            QuestionCount.adjust([question], 1)
+            DataVersion.bump('questions')
+            after_commit(partial(Question.changed, 'insert', question))
 
     def update(self):
-        db.session.commit()
+        with transaction():
+            # the category or difficulty may have changed
+            db.session.flush()
+            QuestionCount.recount()
+            DataVersion.bump('questions')
+            # the pool and the search index are reloaded with the new version
+            after_commit(question_cache.bump)
+            after_commit(warm_caches_later)
 
     def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+        with transaction():
+            question = self.format()
+            db.session.delete(self)
+            QuestionCount.adjust([question], -1)
+            DataVersion.bump('questions')
+            after_commit(partial(Question.changed, 'delete', question))
 
     @classmethod
     def delete_all(cls):
-        for category in Category.query.all():
-            db.session.delete(category)
-        db.session.commit()
+        with transaction():
+            deleted = Question.query.delete(synchronize_session=False)
+            QuestionCount.query.delete(synchronize_session=False)
+            DataVersion.bump('questions')
+            after_commit(question_cache.bump)
+            after_commit(warm_caches_later)
+        return deleted
 
     def format(self):
         return {
@@ -69,18 +396,153 @@ class Question(db.Model):
             'difficulty': self.difficulty
         }
 
+    # keys of format(), in the order of the columns selected by select()
+    FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
     @classmethod
-    def get_questions_by_category_id(cls, category_id):
-        if category_id:
-            questions = list(map(lambda question: question.format(),
-                                 Question.query.filter(Question.category == category_id).all())) or []
-        else:
-            questions = []
-        return questions
+    def columns(cls, fields=FIELDS):
+        return [getattr(cls, field) for field in fields]
+
+    @classmethod
+    def select(cls, fields=FIELDS):
+        """
+        query of the columns of format() as plain rows, so that reads skip
+        building ORM instances and the identity map. `fields` narrows it
+        to some of the keys of format(), in the order of FIELDS.
+        """
+        return db.session.query(*Question.columns(fields))
+
+    @classmethod
+    def format_row(cls, row, fields=FIELDS):
+        return dict(zip(fields, row))
+
+    @classmethod
+    def get_questions_by_category_id(cls, category_id, stream=False, fields=FIELDS):
+        if not category_id:
+            return []
+        if not stream:
+            return Question._get_questions_by_category_id(category_id, fields)
+        query = Question.select(fields).filter(Question.category == category_id).order_by(Question.id)
+        # formatted one chunk of rows at a time from a server-side cursor
+        return (Question.format_row(row, fields) for row in
+                query.execution_options(stream_results=True).yield_per(STREAM_CHUNK_SIZE))
 
     @classmethod
+    @coalesced(question_cache)
+    def _get_questions_by_category_id(cls, category_id, fields=FIELDS):
+        query = Question.select(fields).filter(Question.category == category_id).order_by(Question.id)
+        return [Question.format_row(row, fields) for row in query]
+
+    @classmethod
+    @coalesced(question_cache, category_cache)
+    def get_category_and_questions(cls, category_id, fields=FIELDS):
+        """
+        returns the category and its questions in a single statement, or
+        None and no questions when the category does not exist
+        """
+        if not str(category_id).isdigit():
+            return None, []
+        # questions.id tells a category without questions from its questions
+        rows = db.session.query(Category.id, Category.type, Question.id, *Question.columns(fields)) \
+            .outerjoin(Question, Question.category == Category.id) \
+            .filter(Category.id == int(category_id)).order_by(Question.id).all()
+        if not rows:
+            return None, []
+        category = {'id': rows[0][0], 'type': rows[0][1]}
+        return category, [Question.format_row(row[3:], fields) for row in rows if row[2] is not None]
+
+    @classmethod
+    def count_by_category_id(cls, category_id):
+        return sum(total for category, _, total in QuestionCount.get_counts() if str(category) == str(category_id))
+
+    @classmethod
+    @coalesced(question_cache)
     def get_questions(cls):
-        return list(map(lambda question: question.format(), Question.query.all()))
+        return [Question.format_row(row) for row in Question.select().order_by(Question.id)]
+
+    @classmethod
+    @coalesced(question_cache)
+    def get_questions_page(cls, page, size, fields=FIELDS):
+        rows = Question.select(fields).order_by(Question.id).limit(size).offset((page - 1) * size)
+        return [Question.format_row(row, fields) for row in rows]
+
+    @classmethod
+    @coalesced(question_cache)
+    def get_questions_after(cls, after_id, size, fields=FIELDS):
+        rows = Question.select(fields).filter(Question.id > after_id).order_by(Question.id).limit(size)
+        return [Question.format_row(row, fields) for row in rows]
+
+    @classmethod
+    def bulk_insert(cls, questions):
+        """
+        inserts a chunk of questions, given as dicts, in one transaction:
+        through COPY on Postgres and a single executemany elsewhere
+        """
+        if not questions:
+            return 0
+        with transaction():
+            if db.session.get_bind().dialect.name == 'postgresql':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for question in questions:
+                    writer.writerow([question.get('question'), question.get('answer'),
+                                     question.get('category'), question.get('difficulty')])
+                buffer.seek(0)
+                cursor = db.session.connection().connection.cursor()
+                cursor.copy_expert('COPY questions (question, answer, category, difficulty) FROM STDIN WITH CSV',
+                                   buffer)
+            else:
+                db.session.execute(Question.__table__.insert(), questions)
+            QuestionCount.adjust(questions, 1)
+            DataVersion.bump('questions')
+            # questions pools and search index are reloaded with the new version
+            after_commit(question_cache.bump)
+            after_commit(warm_caches_later)
+        return len(questions)
+
+    @classmethod
+    def bulk_delete(cls, question_ids):
+        """
+        deletes the questions of the given ids with a single statement and
+        returns how many existed
+        """
+        if not question_ids:
+            return 0
+        with transaction():
+            questions = [Question.format_row(row) for row in Question.select().filter(Question.id.in_(question_ids))]
+            deleted = Question.query.filter(Question.id.in_([question.get('id') for question in questions])) \
+                .delete(synchronize_session=False)
+            if deleted == len(questions):
+                QuestionCount.adjust(questions, -1)
+            else:
+                # a concurrent transaction deleted some of them first
+                QuestionCount.recount()
+            DataVersion.bump('questions')
+            after_commit(question_cache.bump)
+            after_commit(warm_caches_later)
+        return deleted
+
+    @classmethod
+    def export(cls, chunk_size):
+        return db.session.query(Question.id, Question.question, Question.answer, Question.category,
+                                Question.difficulty) \
+            .order_by(Question.id).execution_options(stream_results=True).yield_per(chunk_size)
+
+    @classmethod
+    def count(cls):
+        return sum(total for _, _, total in QuestionCount.get_counts())
+
+    @classmethod
+    def changed(cls, event, question):
+        version = question_cache.bump()
+        if event == 'insert':
+            question_pool.add(question.get('id'), question.get('category'), question.get('difficulty'), version)
+            search_index.add(question.get('id'), question.get('question'), question.get('answer'), version)
+        else:
+            question_pool.remove(question.get('id'), question.get('category'), question.get('difficulty'), version)
+            search_index.remove(question.get('id'), version)
+        formatted_questions.changed(question.get('id'), version)
+
     @classmethod
     def get_question_by_id(cls, question_id):
         if question_id:
@@ -88,33 +550,90 @@ class Question(db.Model):
         else:
             return None
     @classmethod
-    def search_question_by_term(cls, term):
-        return list(map(lambda question: question.format(),
-                        Question.query.filter(Question.question.ilike('%' + term + '%')).all()))
+    @coalesced(question_cache)
+    def search_question_by_term(cls, term, page, size, fields=FIELDS):
+        tokens = tokenize(term)
+        if not tokens:
+            return Question.get_questions_page(page, size, fields), Question.count()
+        if db.session.get_bind().dialect.name == 'postgresql':
+            document = literal_column(SEARCH_DOCUMENT)
+            query = func.to_tsquery('simple', to_tsquery(tokens))
+            matches = Question.select(fields).filter(document.op('@@')(query))
+            total = matches.count()
+            rows = matches.order_by(func.ts_rank(document, query).desc(), Question.id) \
+                .limit(size).offset((page - 1) * size)
+            return [Question.format_row(row, fields) for row in rows], total
+        question_ids, total = search_index.search(tokens, (page - 1) * size, size)
+        if not question_ids:
+            return [], total
+        questions = dict((row[0], Question.format_row(row[1:], fields))
+                         for row in db.session.query(Question.id, *Question.columns(fields))
+                         .filter(Question.id.in_(question_ids)))
+        return [questions[question_id] for question_id in question_ids if question_id in questions], total
 
     @classmethod
-    def get_random_question(cls, previous_questions, quiz_category):
-        fetched_questions = Question.query.filter(
-                                Question.id.notin_([pq for pq in previous_questions]),
-                                Question.category == quiz_category.get('id'))
+    def get_random_question(cls, previous_questions, quiz_category, difficulty=None):
+        """
+        draws a question of quiz_category, or of any category for id 0, that
+        is not one of previous_questions, of the given difficulty or else the
+        nearest one
+        """
+        seen = previous_questions if isinstance(previous_questions, SeenSet) else SeenSet(previous_questions)
+        while True:
+            question_id = question_pool.sample((quiz_category or {}).get('id'), seen, difficulty)
+            if question_id is None:
+                return False
+            question = formatted_questions.get_or_set(question_id, Question._get_question_row)
+            if question:
+                return question
+            # deleted by another worker since the pool was loaded
+            seen.add(question_id)
+            question_pool.expire()
 
-        questions = list(map(lambda question: question.format(), fetched_questions)) or []
-        if len(questions) != 0:
-            return random.choice(questions)
-        else:
-            return False
+    @classmethod
+    def get_random_questions(cls, previous_questions, quiz_category, count, difficulty=None):
+        """
+        draws up to `count` distinct questions like get_random_question(),
+        the ones not cached being read with a single statement
+        """
+        seen = previous_questions if isinstance(previous_questions, SeenSet) else SeenSet(previous_questions)
+        questions = []
+        while len(questions) < count:
+            question_ids = question_pool.sample_many((quiz_category or {}).get('id'), seen, count - len(questions),
+                                                     difficulty)
+            found = Question.get_questions_by_ids(question_ids)
+            questions.extend(found)
+            for question_id in question_ids:
+                seen.add(question_id)
+            if len(found) == len(question_ids):
+                break
+            # some were deleted by another worker since the pool was loaded
+            question_pool.expire()
+        return questions
 
+    @classmethod
+    def get_questions_by_ids(cls, question_ids):
+        return formatted_questions.get_many(question_ids, Question._get_question_rows)
 
-    def insert(self):
-        db.session.add(self)
-        db.session.commit()
-        db.session.close()
+    @classmethod
+    def _get_question_row(cls, question_id):
+        row = Question.select().filter(Question.id == question_id).first()
+        return Question.format_row(row) if row else None
+
+    @classmethod
+    def _get_question_rows(cls, question_ids):
+        rows = Question.select().filter(Question.id.in_(question_ids))
+        return dict((row[0], Question.format_row(row)) for row in rows)
 
-    def delete(self):
-        db.session.delete(self)
-        db.session.commit()
-        db.session.close()
 
+question_pool = TenantLocal(lambda: QuestionPool(
+    loader=lambda: db.session.query(Question.id, Question.category, Question.difficulty).all(),
+    version=question_cache.version))
+formatted_questions = cache.caches['quiz_questions'] = TenantLocal(
+    lambda: FormattedQuestions(QUIZ_QUESTION_CACHE_SIZE, question_cache.version))
+search_index = TenantLocal(lambda: InvertedIndex(
+    loader=lambda: db.session.query(Question.id, Question.question, Question.answer).all(),
+    version=question_cache.version))
 
 """
 Category
@@ -138,23 +657,217 @@ class Category(db.Model):
         }
 
     @classmethod
+    @coalesced(category_cache)
     def get_categories(cls):
-        return list(map(lambda category: category.format(), Category.query.all()))
+        return category_cache.get_or_set('all', lambda: [
+            {'id': category_id, 'type': category_type}
+            for category_id, category_type in db.session.query(Category.id, Category.type).order_by(Category.id)])
 
     @classmethod
     def get_category_by_id(cls, category_id):
-        category = category_id and Category.query.get(category_id) or None
-        if category:
-            return category.format()
+        if not category_id:
+            return None
+        return category_cache.get_or_set('id:{}'.format(category_id),
+                                         lambda: cls._get_category_by_id(category_id))
+
+    @classmethod
+    def _get_category_by_id(cls, category_id):
+        row = db.session.query(Category.id, Category.type).filter(Category.id == category_id).first()
+        if row:
+            return {'id': row[0], 'type': row[1]}
         else:
             return None
 
     def insert(self):
-        db.session.add(self)
-        db.session.commit()
+        with transaction():
+            db.session.add(self)
+            DataVersion.bump('categories')
+            after_commit(category_cache.bump)
 
     @classmethod
     def delete_all(cls):
-        for category in Category.query.all():
-            db.session.delete(category)
-        db.session.commit()
\ No newline at end of file
+        with transaction():
+            deleted = Category.query.delete(synchronize_session=False)
+            # the questions of the categories are left without one
+            QuestionCount.recount()
+            DataVersion.bump('categories', 'questions')
+            after_commit(category_cache.bump)
+            after_commit(question_cache.bump)
+            after_commit(warm_caches_later)
+        return deleted
+
+
+"""
+QuestionCount
+    number of questions per category and difficulty, kept up to date by the
+    writes of Question within their own transaction, so that totals are
+    read without counting the questions table. 0 stands for no category or
+    no difficulty, the columns being the primary key.
+"""
+
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    difficulty = Column(Integer, primary_key=True, autoincrement=False)
+    total = Column(Integer, nullable=False)
+
+    # ON CONFLICT needs Postgres 9.5 or SQLite 3.24
+    ADJUST = text('INSERT INTO question_counts (category, difficulty, total) VALUES (:category, :difficulty, :delta) '
+                  'ON CONFLICT (category, difficulty) DO UPDATE SET total = question_counts.total + excluded.total')
+
+    @classmethod
+    def adjust(cls, questions, sign):
+        """adds sign, 1 or -1, to the counts of the given questions"""
+        deltas = {}
+        for question in questions:
+            key = (int(question.get('category') or 0), int(question.get('difficulty') or 0))
+            deltas[key] = deltas.get(key, 0) + sign
+        if deltas:
+            db.session.execute(cls.ADJUST, [{'category': category, 'difficulty': difficulty, 'delta': delta}
+                                            for (category, difficulty), delta in sorted(deltas.items())])
+
+    @classmethod
+    def recount(cls):
+        QuestionCount.query.delete(synchronize_session=False)
+        db.session.execute(text(COUNT_QUESTIONS))
+
+    @classmethod
+    def get_counts(cls):
+        """returns [category, difficulty, total] for every non empty count"""
+        return question_cache.get_or_set('counts', lambda: [
+            [category, difficulty, total] for category, difficulty, total in
+            db.session.query(cls.category, cls.difficulty, cls.total).filter(cls.total > 0)
+            .order_by(cls.category, cls.difficulty)])
+
+    @classmethod
+    def get_stats(cls):
+        categories = dict((category.get('id'), dict(category, total_questions=0, difficulties={}))
+                          for category in Category.get_categories())
+        difficulties = {}
+        total = 0
+        for category_id, difficulty, count in cls.get_counts():
+            total += count
+            difficulties[str(difficulty)] = difficulties.get(str(difficulty), 0) + count
+            if category_id in categories:
+                categories[category_id]['total_questions'] += count
+                categories[category_id]['difficulties'][str(difficulty)] = count
+        return {
+            'total_questions': total,
+            'categories': [categories[category_id] for category_id in sorted(categories)],
+            'difficulties': difficulties
+        }
+
+
+"""
+DataVersion
+    version of the rows of a table, incremented by its writes within their
+    own transaction. The ETags of the read endpoints are derived from them,
+    so every worker answers with the same ETag whichever worker wrote.
+"""
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+    BUMP = text('UPDATE data_versions SET version = version + 1 WHERE name = :name')
+
+    # caches of the worker holding the rows of a table
+    caches = {'questions': question_cache, 'categories': category_cache}
+    # versions of the last get_versions() of the worker, by tenant
+    seen = {}
+
+    @classmethod
+    def bump(cls, *names):
+        db.session.execute(cls.BUMP, [{'name': name} for name in names])
+        after_commit(partial(cls.wrote, current_tenant(), names))
+
+    @classmethod
+    def wrote(cls, tenant, names):
+        # the writes of the worker invalidated its caches already
+        seen = cls.seen.get(tenant, {})
+        for name in names:
+            if name in seen:
+                seen[name] += 1
+
+    @classmethod
+    def get_versions(cls):
+        """
+        the versions of the tables, by name. The caches of a table whose
+        version moved since the last look of the worker are invalidated, as
+        the memory cache backend does not see the writes of the other workers.
+        """
+        versions = dict(db.session.query(cls.name, cls.version))
+        seen = cls.seen.get(current_tenant(), {})
+        for name, version in versions.items():
+            if seen.get(name) != version and name in cls.caches:
+                cls.caches[name].bump()
+        cls.seen[current_tenant()] = versions
+        return versions
+
+
+"""
+QuizSession
+    questions already played by a quiz, held in the database so that every
+    worker finds the session of the token the client sends back instead of
+    the whole list of previous questions, and the current difficulty of an
+    adaptive quiz. The questions drawn by the server are kept apart from the
+    previous questions sent by the client, as only their answers may be
+    checked.
+"""
+
+
+class QuizSession(object):
+    # expired sessions are purged once every PURGE_INTERVAL seconds, by tenant
+    PURGE_INTERVAL = 60
+
+    SELECT = text('SELECT seen, drawn, difficulty FROM quiz_sessions WHERE token = :token AND expires_at > :now')
+    INSERT = text('INSERT INTO quiz_sessions (token, seen, drawn, difficulty, expires_at) '
+                  'VALUES (:token, :seen, :drawn, :difficulty, :expires_at)')
+    UPDATE = text('UPDATE quiz_sessions SET seen = :seen, drawn = :drawn, difficulty = :difficulty, '
+                  'expires_at = :expires_at WHERE token = :token')
+    PURGE = text('DELETE FROM quiz_sessions WHERE expires_at <= :now')
+
+    purged_at = {}
+
+    def __init__(self, token, seen, difficulty=None, drawn=None, saved=False):
+        self.token = token
+        self.seen = seen
+        self.difficulty = difficulty
+        self.drawn = drawn if drawn is not None else SeenSet()
+        self._saved = saved
+
+    @classmethod
+    def create(cls, previous_questions=()):
+        return cls(secrets.token_urlsafe(16), SeenSet(previous_questions))
+
+    @classmethod
+    def get(cls, token):
+        row = db.session.execute(cls.SELECT, {'token': token, 'now': time.time()}).first()
+        if row is None:
+            return None
+        return cls(token, SeenSet.loads(row.seen), row.difficulty, SeenSet.loads(row.drawn), saved=True)
+
+    def draw(self, question_id):
+        """marks a question drawn for the quiz, and so played"""
+        self.seen.add(question_id)
+        self.drawn.add(question_id)
+
+    def save(self):
+        now = time.time()
+        with transaction():
+            db.session.execute(self.UPDATE if self._saved else self.INSERT, {
+                'token': self.token,
+                'seen': self.seen.dumps(),
+                'drawn': self.drawn.dumps(),
+                'difficulty': self.difficulty,
+                'expires_at': now + QUIZ_SESSION_TTL
+            })
+            if now - self.purged_at.setdefault(current_tenant(), now) >= self.PURGE_INTERVAL:
+                self.purged_at[current_tenant()] = now
+                db.session.execute(self.PURGE, {'now': now})
+        self._saved = True
@@ -0,0 +1,294 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from settings import QUIZ_POOL_TTL
+
+"""
+SeenSet
+    set of the ids of the questions played by a quiz. It is serialized as
+    its sorted ids, each written in hex as the difference to the previous
+    one, so that a quiz session grows with the questions played rather than
+    with their ids.
+"""
+
+
+class SeenSet(object):
+
+    def __init__(self, ids=()):
+        self._ids = set(int(question_id) for question_id in ids)
+
+    def add(self, question_id):
+        self._ids.add(int(question_id))
+
+    def __contains__(self, question_id):
+        return question_id in self._ids
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def dumps(self):
+        ids = sorted(self._ids)
+        return ','.join(format(question_id - previous, 'x') for previous, question_id in zip([0] + ids, ids))
+
+    @classmethod
+    def loads(cls, value):
+        ids, question_id = [], 0
+        for delta in value.split(',') if value else []:
+            question_id += int(delta, 16)
+            ids.append(question_id)
+        return cls(ids)
+
+
+"""
+QuestionPool
+    ids of the questions grouped by category and difficulty, kept in memory
+    so that a quiz question is drawn without scanning the questions table.
+    The pool is rebuilt with `loader` whenever the version of the questions
+    cache moved, and at least every `ttl` seconds for the writes of the
+    workers which do not share the version, and is updated in place by
+    add()/remove() for the writes of this worker.
+"""
+
+
+class QuestionPool(object):
+    # random draws tried before falling back to filtering the buckets
+    SAMPLE_ATTEMPTS = 8
+
+    def __init__(self, loader, version, ttl=QUIZ_POOL_TTL):
+        self._loader = loader
+        self._version = version
+        self.ttl = ttl
+        self._loaded_version = None
+        self._expires_at = 0
+        self._ids = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        version = self._version()
+        if version == self._loaded_version and time.time() < self._expires_at:
+            return
+        with self._lock:
+            if version == self._loaded_version and time.time() < self._expires_at:
+                return
+            ids, positions = {}, {}
+            for question_id, category, difficulty in self._loader():
+                self._append(ids, positions, question_id, category, difficulty)
+            self._ids, self._positions = ids, positions
+            self._loaded_version = version
+            self._expires_at = time.time() + self.ttl
+
+    def expire(self):
+        """reloads the pool before the next draw, once it drew a question which no longer exists"""
+        self._expires_at = 0
+
+    @staticmethod
+    def _key(category, difficulty):
+        return str(category), int(difficulty or 0)
+
+    @classmethod
+    def _append(cls, ids, positions, question_id, category, difficulty):
+        key = cls._key(category, difficulty)
+        bucket = ids.setdefault(key, [])
+        positions.setdefault(key, {})[question_id] = len(bucket)
+        bucket.append(question_id)
+
+    def add(self, question_id, category, difficulty, version):
+        with self._lock:
+            if self._loaded_version is not None and self._loaded_version + 1 == version:
+                self._append(self._ids, self._positions, question_id, category, difficulty)
+                self._loaded_version = version
+
+    def remove(self, question_id, category, difficulty, version):
+        with self._lock:
+            if self._loaded_version is None or self._loaded_version + 1 != version:
+                return
+            key = self._key(category, difficulty)
+            bucket, positions = self._ids.get(key, []), self._positions.get(key, {})
+            if question_id in positions:
+                # swap with the last id so that the removal is O(1)
+                index = positions.pop(question_id)
+                last = bucket.pop()
+                if last != question_id:
+                    bucket[index] = last
+                    positions[last] = index
+            self._loaded_version = version
+
+    def contains(self, question_id):
+        """whether the question is in the pool, as loaded by this worker"""
+        self.refresh()
+        return any(question_id in positions for positions in list(self._positions.values()))
+
+    def _buckets(self, category):
+        # category 0, or no category, stands for all of them
+        self.refresh()
+        if not category or str(category) == '0':
+            return list(self._ids.items())
+        return [(key, bucket) for key, bucket in list(self._ids.items()) if key[0] == str(category)]
+
+    def ids(self, category, difficulty=None):
+        return [question_id for (_, bucket_difficulty), bucket in self._buckets(category)
+                if difficulty is None or bucket_difficulty == int(difficulty) for question_id in bucket]
+
+    def difficulties(self, category):
+        return sorted(set(difficulty for (_, difficulty), bucket in self._buckets(category) if bucket))
+
+    def sample(self, category, seen, difficulty=None):
+        """
+        draws a question of the category that is not in seen, of the given
+        difficulty when there is one left, of the nearest difficulty else
+        """
+        buckets = self._buckets(category)
+        if difficulty is None:
+            return self._sample([bucket for _, bucket in buckets], seen)
+        by_difficulty = {}
+        for (_, bucket_difficulty), bucket in buckets:
+            by_difficulty.setdefault(bucket_difficulty, []).append(bucket)
+        for bucket_difficulty in sorted(by_difficulty, key=lambda d: (abs(d - int(difficulty)), d)):
+            question_id = self._sample(by_difficulty[bucket_difficulty], seen)
+            if question_id is not None:
+                return question_id
+        return None
+
+    def sample_many(self, category, seen, count, difficulty=None):
+        """draws up to `count` distinct questions like sample(), none of them in seen"""
+        drawn = SeenSet(seen)
+        question_ids = []
+        while len(question_ids) < count:
+            question_id = self.sample(category, drawn, difficulty)
+            if question_id is None:
+                break
+            drawn.add(question_id)
+            question_ids.append(question_id)
+        return question_ids
+
+    def _sample(self, buckets, seen):
+        buckets = [bucket for bucket in buckets if bucket]
+        total = sum(len(bucket) for bucket in buckets)
+        if not total:
+            return None
+        for _ in range(self.SAMPLE_ATTEMPTS):
+            # a uniform draw over the ids of all the buckets
+            index = random.randrange(total)
+            for bucket in buckets:
+                if index < len(bucket):
+                    break
+                index -= len(bucket)
+            try:
+                question_id = bucket[index]
+            except IndexError:
+                # the bucket shrank under a concurrent remove()
+                continue
+            if question_id not in seen:
+                return question_id
+        remaining = [question_id for bucket in buckets for question_id in bucket if question_id not in seen]
+        return random.choice(remaining) if remaining else None
+
+
+def is_correct(answer, expected):
+    """answers match whatever their case and spacing"""
+    return ' '.join(str(answer).lower().split()) == ' '.join(str(expected).lower().split())
+
+
+def next_difficulty(difficulties, current, correct):
+    """
+    adaptive quizzes move to the next harder difficulty after a right answer
+    and to the next easier one after a wrong one, staying within difficulties
+    """
+    if not difficulties or current is None:
+        return current
+    if correct:
+        harder = [difficulty for difficulty in difficulties if difficulty > current]
+        return harder[0] if harder else difficulties[-1]
+    easier = [difficulty for difficulty in difficulties if difficulty < current]
+    return easier[-1] if easier else difficulties[0]
+
+
+"""
+FormattedQuestions
+    least recently used formatted questions, so that the question drawn for
+    a quiz is usually served without a query. Entries are all dropped when
+    the version moved and every `ttl` seconds, and one by one for the
+    writes of this worker, like the pool.
+"""
+
+
+class FormattedQuestions(object):
+
+    def __init__(self, size, version, ttl=QUIZ_POOL_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._version = version
+        self._loaded_version = None
+        self._expires_at = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        version = self._version()
+        if version != self._loaded_version or time.time() >= self._expires_at:
+            with self._lock:
+                self._entries.clear()
+                self._loaded_version = version
+                self._expires_at = time.time() + self.ttl
+
+    def changed(self, question_id, version):
+        with self._lock:
+            if self._loaded_version is not None and self._loaded_version + 1 == version:
+                self._entries.pop(question_id, None)
+                self._loaded_version = version
+
+    def get_or_set(self, question_id, loader):
+        self._refresh()
+        with self._lock:
+            if question_id in self._entries:
+                self._entries.move_to_end(question_id)
+                self.hits += 1
+                return self._entries[question_id]
+        self.misses += 1
+        question = loader(question_id)
+        if question:
+            with self._lock:
+                self._entries[question_id] = question
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return question
+
+    def get_many(self, question_ids, loader):
+        """
+        the questions of question_ids that exist, in order, the ones not
+        cached being loaded at once by loader(ids), which returns them by id
+        """
+        self._refresh()
+        questions = {}
+        with self._lock:
+            for question_id in question_ids:
+                if question_id in self._entries:
+                    self._entries.move_to_end(question_id)
+                    questions[question_id] = self._entries[question_id]
+        missing = [question_id for question_id in set(question_ids) if question_id not in questions]
+        self.hits += len(questions)
+        self.misses += len(missing)
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                for question_id, question in loaded.items():
+                    self._entries[question_id] = question
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+            questions.update(loaded)
+        return [questions[question_id] for question_id in question_ids if question_id in questions]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries)
+        }
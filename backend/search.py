@@ -0,0 +1,108 @@
+import bisect
+import re
+import threading
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# text searched by the full text index of Postgres. The query must repeat
+# this exact expression for the planner to pick the GIN index up.
+SEARCH_DOCUMENT = "to_tsvector('simple', coalesce(questions.question, '') || ' ' || coalesce(questions.answer, ''))"
+
+CREATE_SEARCH_INDEX = 'CREATE INDEX IF NOT EXISTS questions_search_idx ON questions USING gin ({})'.format(
+    SEARCH_DOCUMENT.replace('questions.', ''))
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN.findall(text or '')]
+
+
+def to_tsquery(tokens):
+    # every token is matched as a prefix, as "who" should find "Whose"
+    return ' & '.join('{}:*'.format(token) for token in tokens)
+
+
+"""
+InvertedIndex
+    in-memory full text index of the questions and their answers, used when
+    the database has no full text search of its own (SQLite in the tests).
+    Like QuestionPool it is rebuilt with `loader` when the version of the
+    questions cache moved and updated in place by add()/remove().
+"""
+
+
+class InvertedIndex(object):
+
+    def __init__(self, loader, version):
+        self._loader = loader
+        self._version = version
+        self._loaded_version = None
+        self._postings = {}
+        self._tokens = []
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        version = self._version()
+        if version == self._loaded_version:
+            return
+        with self._lock:
+            if version == self._loaded_version:
+                return
+            self._postings, self._documents = {}, {}
+            for question_id, question, answer in self._loader():
+                self._index(question_id, question, answer)
+            self._tokens = sorted(self._postings)
+            self._loaded_version = version
+
+    def _index(self, question_id, question, answer):
+        tokens = tokenize(question) + tokenize(answer)
+        self._documents[question_id] = set(tokens)
+        for token in tokens:
+            postings = self._postings.setdefault(token, {})
+            postings[question_id] = postings.get(question_id, 0) + 1
+
+    def add(self, question_id, question, answer, version):
+        with self._lock:
+            if self._loaded_version is None or self._loaded_version + 1 != version:
+                return
+            self._index(question_id, question, answer)
+            self._tokens = sorted(self._postings)
+            self._loaded_version = version
+
+    def remove(self, question_id, version):
+        with self._lock:
+            if self._loaded_version is None or self._loaded_version + 1 != version:
+                return
+            for token in self._documents.pop(question_id, ()):
+                postings = self._postings.get(token, {})
+                postings.pop(question_id, None)
+                if not postings:
+                    del self._postings[token]
+            self._tokens = sorted(self._postings)
+            self._loaded_version = version
+
+    def _match(self, prefix):
+        scores = {}
+        index = bisect.bisect_left(self._tokens, prefix)
+        while index < len(self._tokens) and self._tokens[index].startswith(prefix):
+            for question_id, frequency in self._postings[self._tokens[index]].items():
+                scores[question_id] = scores.get(question_id, 0) + frequency
+            index += 1
+        return scores
+
+    def search(self, tokens, offset, limit):
+        """
+        returns the ids of the questions matching every token, best ranked
+        first, for the requested page, and the total number of matches
+        """
+        self.refresh()
+        scores = None
+        for token in tokens:
+            matches = self._match(token)
+            if scores is None:
+                scores = matches
+            else:
+                scores = dict((question_id, score + matches[question_id])
+                              for question_id, score in scores.items() if question_id in matches)
+        ranked = sorted((scores or {}).items(), key=lambda item: (-item[1], item[0]))
+        return [question_id for question_id, _ in ranked[offset:offset + limit]], len(ranked)
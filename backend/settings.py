@@ -1,8 +1,140 @@
-from dotenv import load_dotenv
 import os
 
-load_dotenv()
+from dotenv import load_dotenv
+
+# .env file read at startup, empty to skip it when the environment is set
+DOTENV_PATH = os.environ.get('DOTENV_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+if DOTENV_PATH and os.path.exists(DOTENV_PATH):
+    load_dotenv(DOTENV_PATH)
 
 DB_NAME = os.environ.get('DB_NAME')
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
+DB_HOST = os.environ.get('DB_HOST', 'localhost:5432')
+# full SQLAlchemy urls, overriding the DB_* variables above when set
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+
+# tenants served by one process, comma separated, each with its own database;
+# empty to serve a single question bank from DATABASE_URL
+TENANTS = [tenant.strip() for tenant in os.environ.get('TENANTS', '').split(',') if tenant.strip()]
+# SQLAlchemy url of the database of a tenant, {tenant} being replaced by its name
+TENANT_DATABASE_URL = os.environ.get('TENANT_DATABASE_URL', '')
+# header naming the tenant of a request, the first label of the host name otherwise
+TENANT_HEADER = os.environ.get('TENANT_HEADER', 'X-Tenant')
+# tenant engines kept open at once, the least recently used idle one is closed beyond
+MAX_TENANT_ENGINES = int(os.environ.get('MAX_TENANT_ENGINES', 16))
+# pooled connections of a tenant engine, and connections opened beyond them
+TENANT_POOL_SIZE = int(os.environ.get('TENANT_POOL_SIZE', 2))
+TENANT_MAX_OVERFLOW = int(os.environ.get('TENANT_MAX_OVERFLOW', 2))
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# seconds a request waits for a pooled connection before failing
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# seconds after which a pooled connection is replaced, -1 to keep it forever
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# milliseconds Postgres lets a statement run, 0 for no limit
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+
+# seconds cached question reads, such as the total number of questions,
+# stay valid when no write bumps the questions cache version
+QUESTION_CACHE_TTL = float(os.environ.get('QUESTION_CACHE_TTL', 5))
+
+# 'memory' keeps cached entries per process, 'sqlite' shares them between
+# the workers of a host through the file at CACHE_PATH
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_PATH = os.environ.get('CACHE_PATH')
+CATEGORY_CACHE_TTL = float(os.environ.get('CATEGORY_CACHE_TTL', 300))
+
+# concurrent calls of a read of models.py with the same arguments share one
+# query within a worker; its result is also kept COALESCE_TTL seconds, 0 to
+# only share the queries in flight
+COALESCE_READS = os.environ.get('COALESCE_READS', 'true').lower() in ('1', 'true', 'yes')
+COALESCE_TTL = float(os.environ.get('COALESCE_TTL', 0))
+
+# seconds a quiz session is kept after its last question
+QUIZ_SESSION_TTL = float(os.environ.get('QUIZ_SESSION_TTL', 3600))
+# seconds after which a worker reloads its quiz question pool, and forgets
+# its formatted questions, so that it sees the writes of the other workers
+QUIZ_POOL_TTL = float(os.environ.get('QUIZ_POOL_TTL', 30))
+# formatted questions kept in memory for the draws of the quizzes
+QUIZ_QUESTION_CACHE_SIZE = int(os.environ.get('QUIZ_QUESTION_CACHE_SIZE', 1024))
+
+# questions inserted per transaction by POST /questions/bulk, and fetched
+# per round trip by GET /questions/export
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+
+# rows fetched per round trip when a list endpoint streams its response
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+
+# Cache-Control header of the responses of the read endpoints
+CACHE_CONTROL = {
+    'categories': os.environ.get('CACHE_CONTROL_CATEGORIES', 'public, max-age=60, stale-while-revalidate=300'),
+    'questions': os.environ.get('CACHE_CONTROL_QUESTIONS', 'no-cache')
+}
+
+# responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# gzip level, 1 (fastest) to 9 (smallest), and brotli quality, 0 to 11
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+# compressed bodies of responses with an ETag kept for the next hits
+COMPRESSION_CACHE_SIZE = int(os.environ.get('COMPRESSION_CACHE_SIZE', 256))
+
+# adds a Server-Timing header with the SQL and serialization time of a request
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+# SQL statements slower than this many milliseconds are logged, 0 to disable
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+# token buckets of the admission control, per client and route, by route
+# class: '<requests per second>/<burst>', empty for no limit. Behind proxies,
+# set TRUSTED_PROXIES first, or every client shares the bucket of the proxy.
+RATE_LIMITS = {
+    'read': os.environ.get('RATE_LIMIT_READ', ''),
+    'search': os.environ.get('RATE_LIMIT_SEARCH', ''),
+    'write': os.environ.get('RATE_LIMIT_WRITE', ''),
+    'quiz': os.environ.get('RATE_LIMIT_QUIZ', '')
+}
+# proxies in front of the server whose X-Forwarded-For, -Proto and -Host
+# headers are trusted, so that the client is the one they forwarded; 0 when
+# the clients connect directly
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+# requests of a route class a worker handles at once, 0 for no limit. Keep
+# search and writes below the connections of the pool so that they can not
+# starve the other routes of connections.
+CONCURRENCY_LIMITS = {
+    'read': int(os.environ.get('CONCURRENCY_READ', 0)),
+    'search': int(os.environ.get('CONCURRENCY_SEARCH', 4)),
+    'write': int(os.environ.get('CONCURRENCY_WRITE', 4)),
+    'quiz': int(os.environ.get('CONCURRENCY_QUIZ', 0))
+}
+
+# 'false' skips the migrations when the app is created, once they are run
+# ahead of a deployment with `python migrations.py`
+MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+# 'background' warms the connection pool and the caches of a new worker in a
+# thread, 'blocking' does it in create_app(), 'off' skips it
+WARMUP = os.environ.get('WARMUP', 'background').lower()
+# pooled connections opened by the warmup, per database
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', DB_POOL_SIZE))
+
+# 'background' runs the jobs queued by the writes (jobs.py) in threads of
+# the worker, 'eager' runs them in the request queuing them
+JOBS_MODE = os.environ.get('JOBS_MODE', 'background').lower()
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+# jobs waiting at most, a request queuing one more runs it itself
+JOBS_QUEUE_SIZE = int(os.environ.get('JOBS_QUEUE_SIZE', 1000))
+# attempts of a failing job, the n-th retry coming JOBS_RETRY_DELAY * 2^(n-1)
+# seconds after the failure
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+JOBS_RETRY_DELAY = float(os.environ.get('JOBS_RETRY_DELAY', 0.5))
+# SQLite file keeping the queued jobs across restarts, shared by the workers
+# of the host; the queue is kept in memory when empty
+JOBS_QUEUE_PATH = os.environ.get('JOBS_QUEUE_PATH')
+# seconds a stopping worker waits for the jobs due to run
+JOBS_DRAIN_TIMEOUT = float(os.environ.get('JOBS_DRAIN_TIMEOUT', 10))
+
+# requests handled at once by a worker of the ASGI app (asgi.py)
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+from jobs import job
+from models import db, question_pool, search_index, Category, QuestionCount
+from settings import WARMUP, WARMUP_CONNECTIONS
+
+logger = logging.getLogger('trivia.startup')
+
+
+def warm_connections(count):
+    """opens `count` pooled connections per database, so that the first requests do not pay for connecting"""
+    app = db.get_app()
+    for bind in [None] + list(app.config['SQLALCHEMY_BINDS']):
+        pool = db.get_engine(app, bind=bind).pool
+        size = pool.size() if hasattr(pool, 'size') else 1
+        connections = [pool.connect() for _ in range(max(min(count, size), 1))]
+        for connection in connections:
+            connection.close()
+
+
+@job('warm_caches', local=True)
+def warm_caches():
+    Category.get_categories()
+    QuestionCount.get_counts()
+    question_pool.refresh()
+    if db.session.get_bind().dialect.name != 'postgresql':
+        search_index.refresh()
+
+
+"""
+Startup
+    readiness of a worker. warm() fills the connection pool and the caches
+    a new worker would otherwise fill with its first requests; the worker
+    reports itself ready on /readyz once that is done.
+"""
+
+
+class Startup(object):
+
+    def __init__(self, app, mode=WARMUP):
+        self.app = app
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.warmup_seconds = None
+        self.error = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self, mode=None):
+        mode = mode or self.mode
+        if mode == 'off':
+            self._ready.set()
+        elif mode == 'blocking':
+            self.warm()
+        else:
+            with self._lock:
+                if self.ready or (self._thread and self._thread.is_alive()):
+                    return
+                self._thread = threading.Thread(target=self.warm, name='trivia-warmup', daemon=True)
+                self._thread.start()
+
+    def warm(self):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                # tenants open their databases, and fill their caches, on first use
+                if 'tenant_engines' not in self.app.extensions:
+                    warm_connections(WARMUP_CONNECTIONS)
+                    warm_caches()
+        except Exception as e:
+            # /readyz starts the warmup again while it fails
+            logger.exception('warmup failed')
+            self.error = str(e)
+            return
+        self.warmup_seconds = time.perf_counter() - started
+        self.error = None
+        self._ready.set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'uptime_seconds': time.perf_counter() - self.started,
+            'warmup_seconds': self.warmup_seconds,
+            'error': self.error
+        }
+
+
+def init_startup(app):
+    startup = app.extensions['startup'] = Startup(app, app.config.get('WARMUP', WARMUP))
+    startup.start()
+    return startup
@@ -0,0 +1,89 @@
+import threading
+
+from flask import abort, g, has_app_context, request
+
+from settings import TENANTS, TENANT_HEADER
+
+# endpoints about the worker itself, answered without a tenant
+WORKER_ROUTES = ('/healthz', '/readyz', '/metrics', '/db/stats', '/jobs/stats', '/cache/stats')
+
+# TenantLocal instances, emptied of a tenant whose engine is closed
+tenant_locals = []
+
+
+def current_tenant():
+    """tenant of the current request or job, None when the process serves a single tenant"""
+    return g.get('tenant') if has_app_context() else None
+
+
+def namespaced(name):
+    """`name` within the namespace of the current tenant"""
+    tenant = current_tenant()
+    return '{}@{}'.format(name, tenant) if tenant else name
+
+
+def drop_tenant(tenant):
+    for local in tenant_locals:
+        local.drop(tenant)
+
+
+"""
+TenantLocal
+    one instance of `factory()` per tenant, created on first use. The
+    attributes read through it are those of the instance of the current
+    tenant, so the in-memory question pools and indexes of the tenants of
+    a process never mix.
+"""
+
+
+class TenantLocal(object):
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+        tenant_locals.append(self)
+
+    def instance(self, tenant=None):
+        tenant = tenant or current_tenant()
+        instance = self._instances.get(tenant)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(tenant)
+                if instance is None:
+                    instance = self._instances[tenant] = self._factory()
+        return instance
+
+    def drop(self, tenant):
+        self._instances.pop(tenant, None)
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
+
+
+def tenant_of_request(header):
+    """the tenant named by the header, or else by the first label of the host name"""
+    return request.headers.get(header) or request.host.split(':')[0].split('.')[0]
+
+
+"""
+init_tenants(app)
+    resolves the tenant of every request of an app serving TENANTS, from
+    the TENANT_HEADER header or the subdomain. A request for an unknown
+    tenant is answered with 404; the worker endpoints need no tenant.
+"""
+
+
+def init_tenants(app):
+    tenants = set(app.config.get('TENANTS', TENANTS))
+    if not tenants:
+        return
+    header = app.config.get('TENANT_HEADER', TENANT_HEADER)
+
+    @app.before_request
+    def resolve_tenant():
+        tenant = tenant_of_request(header)
+        if tenant in tenants:
+            g.tenant = tenant
+        elif not request.url_rule or request.url_rule.rule not in WORKER_ROUTES:
+            abort(404, 'Unknown tenant {}'.format(tenant))
@@ -1,10 +1,167 @@
 import os
+import asyncio
+import contextlib
+import gzip
+import tempfile
+import threading
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from flask import g
+from flask.testing import make_test_environ_builder
+from sqlalchemy import event, orm, text
+from sqlalchemy.engine import Engine
+from werkzeug.wrappers import Response
 
+from admission import Admission
+from asgi import AsgiApp
+import cache
+from cache import MemoryBackend, SingleFlight
 from flaskr import create_app
-from models import setup_db, Question, Category
+from jobs import job, Jobs, MemoryQueue, QueueFull, SQLiteQueue
+from models import db, transaction, question_cache, category_cache, Question, Category, TenantEngines
+from quiz import SeenSet
+from tenants import drop_tenant
+
+
+class StatementCounter(object):
+    """Counts the SQL statements run by any engine within the with block"""
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, connection, cursor, statement, *args):
+        # savepoints are taken by the rolled back transaction of the tests
+        if 'SAVEPOINT' not in statement:
+            self.count += 1
+
+
+# an in-memory database per process unless TEST_DATABASE_URL is set, so that
+# the tests run in parallel processes; the app is warmed up before the test
+# starts, its warmup would race the requests of the test otherwise
+TEST_CONFIG = {
+    'DATABASE_URL': os.environ.get('TEST_DATABASE_URL', 'sqlite://'),
+    'DATABASE_REPLICA_URL': None,
+    'MIGRATE_ON_STARTUP': True,
+    'WARMUP': 'blocking',
+    # jobs run within the transaction of the test, which they would race
+    'JOBS_MODE': 'eager',
+    # as behind a load balancer, clients are told apart by X-Forwarded-For
+    'TRUSTED_PROXIES': 1
+}
+
+CATEGORIES = [
+    {'type': 'Science'},
+    {'type': 'Art'},
+    {'type': 'Geography'},
+    {'type': 'History'},
+    {'type': 'Entertainment'},
+    {'type': 'Sport'}
+]
+QUESTIONS = [
+    {
+        'question': 'What movie earned Tom Hanks his third straight Oscar nomination, in 1996?',
+        'answer': 'Apollo 13',
+        'category': 4,
+        'difficulty': 3
+    },
+    {
+        'question': 'What actor did author Anne Rice first denounce, then praise in the role of her beloved '
+                    'Lestat?',
+        'answer': 'Tom Cruise',
+        'category': 3,
+        'difficulty': 2
+    },
+    {
+        'question': 'Whose autobiography is entitled \'I Know Why the Caged Bird Sings\'?',
+        'answer': 'Maya Angelou',
+        'category': 1,
+        'difficulty': 5
+    },
+    {
+        'question': 'WWhat boxer\'s original name is Cassius Clay?',
+        'answer': 'Muhammad Ali',
+        'category': 6,
+        'difficulty': 3
+    },
+    {
+        'question': 'Who invented Peanut Butter?',
+        'answer': 'George Washington Carver',
+        'category': 5,
+        'difficulty': 1
+    },
+    {
+        'question': 'Who discovered penicillin?',
+        'answer': 'Alexander Fleming',
+        'category': 5,
+        'difficulty': 5
+    }
+]
+
+
+def seed():
+    """Inserts the categories and questions of the tests, once per database"""
+    with transaction():
+        if Category.query.count() == 0:
+            for category in CATEGORIES:
+                Category(**category).insert()
+        if Question.query.count() == 0:
+            for question in QUESTIONS:
+                Question(**question).insert()
+
+
+class RolledBackTransaction(object):
+    """
+    Runs the with block in a transaction rolled back once it ends. The
+    sessions of every thread join it through a savepoint, so the commits
+    and rollbacks of the app stay within the block.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.connection = self.db.engine.connect()
+        self.sqlite = self.connection.dialect.name == 'sqlite'
+        if self.sqlite:
+            # pysqlite would begin the transaction with the first savepoint
+            # and commit it with its release, it is begun here instead
+            self.connection.connection.isolation_level = None
+        self.transaction = self.connection.begin()
+        if self.sqlite:
+            self.connection.execute('BEGIN')
+        factory = self.db.create_session({'bind': self.connection, 'binds': {}, 'query_cls': self.db.Query})
+        event.listen(factory, 'after_transaction_end', self.restart_savepoint)
+
+        def create_session():
+            session = factory()
+            session.begin_nested()
+            return session
+
+        self.session = self.db.session
+        self.db.session = orm.scoped_session(create_session)
+        return self
+
+    def restart_savepoint(self, session, transaction):
+        if transaction.nested and not transaction.parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    def __exit__(self, *exc_info):
+        self.db.session.remove()
+        self.db.session = self.session
+        self.transaction.rollback()
+        if self.sqlite:
+            self.connection.connection.isolation_level = ''
+        self.connection.close()
+        # the caches may hold the writes rolled back
+        question_cache.bump()
+        category_cache.bump()
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -12,84 +169,14 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = create_app(TEST_CONFIG)
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.username = 'flask'
-        self.password = 'flask123'
-        self.database_path = 'postgresql://{}:{}@{}/{}'.format(self.username, self.password, 'localhost:5432',
-                                                               self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
-        categories = [
-            {'type': 'Science'},
-            {'type': 'Art'},
-            {'type': 'Geography'},
-            {'type': 'History'},
-            {'type': 'Entertainment'},
-            {'type': 'Sport'}
-        ]
-        questions = [
-            {
-                'question': 'What movie earned Tom Hanks his third straight Oscar nomination, in 1996?',
-                'answer': 'Apollo 13',
-                'category': 4,
-                'difficulty': 3
-            },
-            {
-                'question': 'What actor did author Anne Rice first denounce, then praise in the role of her beloved '
-                            'Lestat?',
-                'answer': 'Tom Cruise',
-                'category': 3,
-                'difficulty': 2
-            },
-            {
-                'question': 'Whose autobiography is entitled \'I Know Why the Caged Bird Sings\'?',
-                'answer': 'Maya Angelou',
-                'category': 1,
-                'difficulty': 5
-            },
-            {
-                'question': 'WWhat boxer\'s original name is Cassius Clay?',
-                'answer': 'Muhammad Ali',
-                'category': 6,
-                'difficulty': 3
-            },
-            {
-                'question': 'Who invented Peanut Butter?',
-                'answer': 'George Washington Carver',
-                'category': 5,
-                'difficulty': 1
-            },
-            {
-                'question': 'Who discovered penicillin?',
-                'answer': 'Alexander Fleming',
-                'category': 5,
-                'difficulty': 5
-            }
-        ]
-        db_questions = Question.get_questions()
-        db_categories = Category.get_categories()
-        if len(db_categories) == 0:
-            for category in categories:
-                cat = Category(**category)
-                cat.insert()
-        if len(db_questions) == 0:
-            for question in questions:
-                quest = Question(**question)
-                quest.insert()
+        seed()
+        self.transaction = RolledBackTransaction(db).__enter__()
 
     def tearDown(self):
         """Executed after reach test"""
-        # Question.delete_all()
-        # Category.delete_all()
+        self.transaction.__exit__(None, None, None)
 
     """
     TODO
@@ -104,11 +191,97 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data.get('success'), True)
         self.assertTrue(data.get('categories'))
 
+    def test_get_categories_not_modified_success(self):
+        res = self.client().get('/categories')
+        etag = res.headers.get('ETag')
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers.get('ETag'), etag)
+        self.assertIn('max-age', res.headers.get('Cache-Control'))
+
+    def test_get_questions_etag_changes_on_insert_success(self):
+        res = self.client().get('/questions')
+        etag = res.headers.get('ETag')
+        question = {
+            'question': 'Who painted the Mona Lisa?',
+            'answer': 'Leonardo da Vinci',
+            'category': 2,
+            'difficulty': 1
+        }
+
+        self.client().post('/questions', json=question)
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers.get('ETag'), etag)
+
+    def test_get_questions_etag_changes_on_other_worker_write_success(self):
+        res = self.client().get('/questions')
+        etag = res.headers.get('ETag')
+        version = question_cache.version()
+
+        # written as by another worker, whose caches this one does not share
+        db.session.execute(text("UPDATE data_versions SET version = version + 1 WHERE name = 'questions'"))
+        db.session.commit()
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers.get('ETag'), etag)
+        self.assertGreater(question_cache.version(), version)
+
     def test_get_categories_fail(self):
         res = self.client().get('category')
 
         self.assertEqual(res.status_code, 404)
 
+    def test_get_cache_stats_success(self):
+        self.client().get('/categories')
+        self.client().get('/categories')
+
+        res = self.client().get('/cache/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data.get('success'), True)
+        self.assertGreaterEqual(data.get('caches').get('categories').get('hits'), 1)
+
+    def test_get_cache_stats_fail(self):
+        res = self.client().post('/cache/stats')
+
+        self.assertEqual(res.status_code, 405)
+
+    def test_get_metrics_success(self):
+        self.client().get('/categories/5/questions')
+
+        res = self.client().get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('# TYPE trivia_request_duration_seconds histogram', body)
+        self.assertIn('route="/categories/<string:category_id>/questions"', body)
+        self.assertIn('trivia_request_sql_queries_count', body)
+        self.assertIn('trivia_cache_hits{cache="categories"}', body)
+
+    def test_get_metrics_fail(self):
+        res = self.client().post('/metrics')
+
+        self.assertEqual(res.status_code, 405)
+
+    def test_get_db_stats_success(self):
+        res = self.client().get('/db/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data.get('success'), True)
+        self.assertTrue(data.get('pools').get('primary').get('pool'))
+
+    def test_get_db_stats_fail(self):
+        res = self.client().delete('/db/stats')
+
+        self.assertEqual(res.status_code, 405)
+
     def test_get_questions_success(self):
         res = self.client().get('/questions')
         data = json.loads(res.data)
@@ -120,11 +293,106 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data.get('categories'))
         self.assertTrue(data.get('current_category'), data.get('categories')[0])
 
+    def test_get_questions_compressed_success(self):
+        expected = json.loads(self.client().get('/questions').data)
+
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers.get('Content-Encoding'), 'gzip')
+        self.assertIn('Accept-Encoding', res.headers.get('Vary'))
+        self.assertEqual(data, expected)
+
+    def test_get_questions_compressed_stream_success(self):
+        expected = json.loads(self.client().get('/questions').data)
+
+        res = self.client().get('/questions?stream=1', headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(data, expected)
+
+    def test_get_categories_compressed_fail(self):
+        res = self.client().get('/categories', headers={'Accept-Encoding': 'identity'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(res.headers.get('Content-Encoding'))
+        self.assertTrue(json.loads(res.data).get('success'))
+
     def test_get_question_fail(self):
         res = self.client().get('/question')
 
         self.assertEqual(res.status_code, 404)
 
+    def test_get_questions_after_cursor_success(self):
+        res = self.client().get('/questions?size=2')
+        first_page = json.loads(res.data)
+
+        res = self.client().get('/questions?size=2&after={}'.format(first_page.get('next_cursor')))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data.get('success'), True)
+        self.assertEqual(data.get('total_questions'), first_page.get('total_questions'))
+        self.assertGreater(data.get('questions')[0].get('id'), first_page.get('questions')[-1].get('id'))
+
+    def test_get_questions_after_cursor_fail(self):
+        res = self.client().get('/questions?after=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message')[0].get('field'), 'after')
+        self.assertFalse(data.get('success'))
+
+    def test_get_questions_size_is_capped(self):
+        res = self.client().get('/questions?size=100000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(data.get('questions')), 100)
+
+    def test_get_questions_fields_success(self):
+        res = self.client().get('/questions?fields=question,category')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data.get('questions'))
+        self.assertTrue(all(sorted(q) == ['category', 'id', 'question'] for q in data.get('questions')))
+
+    def test_get_questions_fields_fail(self):
+        res = self.client().get('/questions?fields=question,password')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message')[0].get('field'), 'fields')
+        self.assertFalse(data.get('success'))
+
+    def test_get_questions_by_category_columns_success(self):
+        category_id = 5
+        expected = json.loads(self.client().get('/categories/{}/questions'.format(category_id)).data)
+
+        res = self.client().get('/categories/{}/questions?fields=answer'.format(category_id),
+                                headers={'Accept': 'application/vnd.trivia.columns+json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/vnd.trivia.columns+json')
+        self.assertEqual(data.get('questions'), {
+            'id': [q.get('id') for q in expected.get('questions')],
+            'answer': [q.get('answer') for q in expected.get('questions')]
+        })
+        self.assertEqual(data.get('total_questions'), expected.get('total_questions'))
+
+    def test_search_term_columns_fail(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'who'},
+                                 headers={'Accept': 'application/json;q=1, application/vnd.trivia.columns+json;q=0.5'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertIsInstance(data.get('questions'), list)
+
     def test_delete_question_by_id_success(self):
         # Given
         question = {
@@ -160,6 +428,54 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data.get('message'), 'Question with id {} not found'.format(question_id))
         self.assertFalse(data.get('success'))
 
+    def test_delete_questions_success(self):
+        # Given
+        Question.bulk_insert([
+            {'question': 'Who painted the Mona Lisa?', 'answer': 'Leonardo da Vinci', 'category': 2,
+             'difficulty': 1},
+            {'question': 'Who painted Guernica?', 'answer': 'Pablo Picasso', 'category': 2, 'difficulty': 2}
+        ])
+        question_ids = [question.get('id') for question in Question.get_questions()[-2:]]
+
+        # When
+        res = self.client().delete('/questions', json={'ids': question_ids + [100000]})
+        data = json.loads(res.data)
+
+        # Then
+        remaining = set(question.get('id') for question in Question.get_questions())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data.get('deleted'), 2)
+        self.assertTrue(data.get('success'))
+        self.assertFalse(remaining.intersection(question_ids))
+
+    def test_delete_questions_fail(self):
+        res = self.client().delete('/questions', json={'ids': ['one', 'two']})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message')[0].get('field'), 'ids')
+        self.assertFalse(data.get('success'))
+
+    def test_transaction_success(self):
+        count = len(Question.get_questions())
+
+        with transaction():
+            Question(question='Who wrote Hamlet?', answer='William Shakespeare', category=2, difficulty=1).insert()
+            Question(question='Who wrote Faust?', answer='Goethe', category=2, difficulty=2).insert()
+
+        self.assertEqual(len(Question.get_questions()), count + 2)
+
+    def test_transaction_fail(self):
+        count = len(Question.get_questions())
+
+        with self.assertRaises(ValueError):
+            with transaction():
+                Question(question='Who wrote Hamlet?', answer='William Shakespeare', category=2,
+                         difficulty=1).insert()
+                raise ValueError()
+
+        self.assertEqual(len(Question.get_questions()), count)
+
     def test_create_question_success(self):
         question = {
             'question': 'Who was the first president of Cameroon?',
@@ -193,6 +509,96 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(field, 'category')
         self.assertFalse(data.get('success'))
 
+    def test_create_question_invalid_numbers_fail(self):
+        question = {'question': 'Who painted Guernica?', 'answer': 'Picasso', 'category': 0, 'difficulty': 2.7}
+        rows = [dict(question), dict(question, category=None, difficulty=True),
+                dict(question, category='2', difficulty='3')]
+
+        single = json.loads(self.client().post('/questions', json=question).data)
+        res = self.client().post('/questions/bulk', data='\n'.join(json.dumps(row) for row in rows),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        # a single question and a bulk row follow the same rules
+        self.assertEqual(sorted(error.get('message') for error in single.get('message')),
+                         ['Category with id 0 not found', 'difficulty must be an integer'])
+        self.assertEqual(data.get('errors')[0].get('errors'), single.get('message'))
+        self.assertEqual(data.get('errors')[1].get('errors'),
+                         [{'field': 'difficulty', 'message': 'difficulty must be an integer'}])
+        # digit strings, as in a CSV row, are stored as integers
+        self.assertEqual(res.status_code, 207)
+        self.assertEqual(data.get('inserted'), 1)
+        self.assertIn({'question': 'Who painted Guernica?', 'answer': 'Picasso', 'category': 2, 'difficulty': 3},
+                      [dict((field, q.get(field)) for field in q if field != 'id') for q in Question.get_questions()])
+
+    def test_bulk_create_questions_success(self):
+        body = '\n'.join([
+            json.dumps({'question': 'What is the capital of Cameroon?', 'answer': 'Yaounde',
+                        'category': 3, 'difficulty': 2}),
+            json.dumps({'question': 'Which river flows through Cairo?', 'answer': 'The Nile',
+                        'category': 3}),
+            'not json'
+        ])
+
+        res = self.client().post('/questions/bulk', data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 207)
+        self.assertEqual(data.get('inserted'), 1)
+        self.assertEqual([error.get('line') for error in data.get('errors')], [2, 3])
+        self.assertEqual(data.get('errors')[0].get('errors')[0].get('field'), 'difficulty')
+
+    def test_bulk_create_questions_csv_success(self):
+        body = 'question,answer,category,difficulty\n' \
+               'What is the capital of Kenya?,Nairobi,3,2\n' \
+               'What is the capital of Ghana?,Accra,300,2\n'
+
+        res = self.client().post('/questions/bulk?chunk_size=1', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 207)
+        self.assertEqual(data.get('inserted'), 1)
+        self.assertEqual(data.get('errors')[0].get('errors')[0].get('message'), 'Category with id 300 not found')
+
+    def test_bulk_create_questions_invalid_utf8_success(self):
+        row = json.dumps({'question': 'What is the capital of Peru?', 'answer': 'Lima', 'category': 3, 'difficulty': 1})
+        body = b'\n'.join([row.encode(), b'{"question": "Caf\xe9?"}', row.encode()])
+        csv_body = b'question,answer,category,difficulty\nCaf\xe9?,Lima,3,1\nWhere is Lima?,Peru,3,1\n'
+
+        res = self.client().post('/questions/bulk?chunk_size=1', data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        csv_res = self.client().post('/questions/bulk', data=csv_body, content_type='text/csv')
+
+        # the rows before and after the line that is not UTF-8 are inserted
+        self.assertEqual(res.status_code, 207)
+        self.assertEqual(data.get('inserted'), 2)
+        self.assertEqual(data.get('errors'), [{'line': 2, 'errors': [{'field': None, 'message': 'invalid row'}]}])
+        self.assertEqual(json.loads(csv_res.data).get('inserted'), 1)
+        self.assertEqual(json.loads(csv_res.data).get('errors')[0].get('line'), 2)
+
+    def test_bulk_create_questions_fail(self):
+        res = self.client().post('/questions/bulk', data='<questions/>', content_type='application/xml')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 415)
+        self.assertFalse(data.get('success'))
+
+    def test_export_questions_success(self):
+        res = self.client().get('/questions/export')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(rows), Question.count())
+        self.assertEqual(sorted(rows[0]), ['answer', 'category', 'difficulty', 'id', 'question'])
+
+    def test_export_questions_fail(self):
+        res = self.client().get('/questions/export?format=xml')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message')[0].get('field'), 'format')
+
     def test_search_term_success(self):
         keyword = {
             'searchTerm': 'who'
@@ -205,6 +611,30 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data.get('questions'))
         self.assertTrue(data.get('total_questions'))
 
+    def test_search_term_matches_answers_success(self):
+        keyword = {
+            'searchTerm': 'flem'
+        }
+
+        res = self.client().post('/questions/search', json=keyword)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data.get('questions'))
+        self.assertTrue(all(q.get('answer') == 'Alexander Fleming' for q in data.get('questions')))
+
+    def test_search_term_paginated_success(self):
+        keyword = {
+            'searchTerm': 'who'
+        }
+
+        res = self.client().post('/questions/search?size=1', json=keyword)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data.get('questions')), 1)
+        self.assertGreater(data.get('total_questions'), 1)
+
     def test_search_term_fail(self):
         keyword = {
         }
@@ -230,6 +660,38 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data.get('current_category'))
         self.assertTrue(data.get('success'))
 
+    def test_get_questions_by_category_stream_success(self):
+        category_id = 5
+        expected = json.loads(self.client().get('/categories/{}/questions'.format(category_id)).data)
+
+        res = self.client().get('/categories/{}/questions?stream=1'.format(category_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data, expected)
+
+    def test_get_questions_by_category_ndjson_success(self):
+        category_id = 5
+
+        res = self.client().get('/categories/{}/questions'.format(category_id),
+                                headers={'Accept': 'application/x-ndjson'})
+        lines = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(lines[0].get('success'))
+        self.assertEqual(lines[0].get('total_questions'), len(lines) - 1)
+        self.assertTrue(all(line.get('category') == category_id for line in lines[1:]))
+
+    def test_get_questions_by_category_stream_fail(self):
+        category_id = 200
+
+        res = self.client().get('/categories/{}/questions?stream=1'.format(category_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data.get('success'))
+
     def test_get_questions_by_category_fail(self):
         category_id = 200
         res = self.client().get('/categories/{}/questions'.format(category_id))
@@ -239,6 +701,255 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data.get('message'), 'Category with id {} not found'.format(category_id))
         self.assertFalse(data.get('success'))
 
+    def test_rate_limit_success(self):
+        self.app.extensions['admission'].rate_limits['search'] = (1, 2)
+
+        first = self.client().post('/questions/search', json={'searchTerm': 'who'})
+        second = self.client().post('/questions/search', json={'searchTerm': 'who'})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+
+    def test_rate_limit_per_forwarded_client_success(self):
+        self.app.extensions['admission'].rate_limits['search'] = (0.1, 1)
+
+        first = self.client().post('/questions/search', json={'searchTerm': 'who'},
+                                   headers={'X-Forwarded-For': '203.0.113.1'})
+        second = self.client().post('/questions/search', json={'searchTerm': 'who'},
+                                    headers={'X-Forwarded-For': '203.0.113.2'})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+
+    def test_rate_limit_buckets_purged_success(self):
+        backend = MemoryBackend()
+        backend.PURGE_EVERY = 10
+        for client in range(10):
+            backend.take('rate:search:{}'.format(client), 1000, 1)
+        # full again after a millisecond, the buckets go with the next purge
+        time.sleep(0.01)
+        for client in range(10, 20):
+            backend.take('rate:search:{}'.format(client), 1000, 1)
+
+        self.assertLessEqual(len(backend._data), 10)
+
+    def test_rate_limit_fail(self):
+        self.app.extensions['admission'].rate_limits['search'] = (0.1, 1)
+
+        self.client().post('/questions/search', json={'searchTerm': 'who'})
+        res = self.client().post('/questions/search', json={'searchTerm': 'who'})
+        data = json.loads(res.data)
+        rendered = self.client().get('/metrics').data.decode()
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res.headers.get('Retry-After'), '10')
+        self.assertFalse(data.get('success'))
+        self.assertIn('trivia_admission_rejections_total{route_class="search",reason="rate"}', rendered)
+
+    def test_rate_limit_config_fail(self):
+        # refused when the app starts, rather than failing every request of the class
+        for limit in ('0/5', '-1/5', '5/0.5', 'fast'):
+            with self.assertRaises(ValueError):
+                Admission(MemoryBackend(), {'search': limit}, {})
+
+    def test_concurrency_limit_fail(self):
+        semaphore = self.app.extensions['admission'].semaphores['write']
+        held = 0
+        while semaphore.acquire(blocking=False):
+            held += 1
+        try:
+            res = self.client().post('/questions', json={'question': 'Who?', 'answer': 'Me', 'category': 1,
+                                                         'difficulty': 1})
+        finally:
+            for _ in range(held):
+                semaphore.release()
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers.get('Retry-After'), '1')
+        self.assertFalse(data.get('success'))
+
+    def test_healthz_success(self):
+        res = self.client().get('/healthz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data.get('status'), 'alive')
+
+    def test_readyz_success(self):
+        res = self.client().get('/readyz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data.get('ready'))
+        self.assertTrue(data.get('success'))
+        self.assertIsNotNone(data.get('warmup_seconds'))
+
+    def test_readyz_fail(self):
+        startup = self.app.extensions['startup']
+        startup.error = 'database is down'
+        startup.start = lambda: None
+        startup._ready.clear()
+
+        res = self.client().get('/readyz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertFalse(data.get('ready'))
+        self.assertEqual(data.get('error'), 'database is down')
+
+    def test_jobs_success(self):
+        ran = []
+        job('test_append')(ran.append)
+        jobs = Jobs(self.app, MemoryQueue(10), mode='background', workers=1)
+        jobs.start()
+
+        jobs.enqueue('test_append', 1)
+        jobs.enqueue('test_append', 2)
+        jobs.drain(5)
+
+        self.assertEqual(ran, [1, 2])
+        self.assertEqual(jobs.stats().get('queued'), 0)
+
+    def test_jobs_retry_success(self):
+        attempts = []
+
+        @job('test_flaky')
+        def flaky():
+            attempts.append(time.time())
+            if len(attempts) < 3:
+                raise ValueError('flaky')
+
+        jobs = Jobs(self.app, MemoryQueue(10), mode='background', workers=1, retry_delay=0.01)
+        jobs.start()
+
+        jobs.enqueue('test_flaky')
+        deadline = time.time() + 5
+        while len(attempts) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        jobs.drain(5)
+
+        self.assertEqual(len(attempts), 3)
+        # waits 0.01s then 0.02s
+        self.assertGreaterEqual(attempts[2] - attempts[1], 0.02)
+
+    def test_jobs_fail(self):
+        attempts = []
+
+        @job('test_broken')
+        def broken():
+            attempts.append(1)
+            raise ValueError('broken')
+
+        queue = MemoryQueue(10)
+        jobs = Jobs(self.app, queue, max_attempts=2, retry_delay=0)
+
+        jobs.enqueue('test_broken')
+        jobs.run(queue.get(0))
+        jobs.run(queue.get(0))
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(len(queue), 0)
+        self.assertIn('trivia_jobs_total{job="test_broken",outcome="failed"}',
+                      self.client().get('/metrics').data.decode())
+
+    def test_jobs_sqlite_queue_success(self):
+        path = os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3')
+        SQLiteQueue(path, 10).put('test_append', [3])
+
+        # the queue of the next worker finds the job, leased to one of them
+        queue = SQLiteQueue(path, 10)
+        queued = queue.get(0)
+        leased = queue.get(0)
+        queue.done(queued)
+
+        self.assertEqual(queued[1:], ('test_append', [3], 0, None))
+        self.assertIsNone(leased)
+        self.assertEqual(len(queue), 0)
+
+    def test_jobs_local_queue_success(self):
+        ran = []
+        job('test_warm', local=True)(ran.append)
+        job('test_append')(ran.append)
+        shared = SQLiteQueue(os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3'), 10)
+        local = MemoryQueue(10)
+        jobs = Jobs(self.app, shared, mode='background', local_queue=local)
+
+        jobs.enqueue('test_warm', 1)
+        jobs.enqueue('test_append', 2)
+
+        # the job filling the memory of this worker is not handed to the others
+        self.assertEqual(local.get(0)[1:], ('test_warm', [1], 0, None))
+        self.assertEqual(shared.get(0)[1:], ('test_append', [2], 0, None))
+        self.assertEqual(jobs.stats().get('queued'), 1)
+
+    def test_jobs_queue_full_fail(self):
+        ran = []
+        job('test_append')(ran.append)
+        queue = MemoryQueue(1)
+        jobs = Jobs(self.app, queue)
+
+        jobs.enqueue('test_append', 1)
+        # the request queuing into a full queue runs the job itself
+        jobs.enqueue('test_append', 2)
+
+        self.assertEqual(ran, [2])
+        self.assertEqual(len(queue), 1)
+        with self.assertRaises(QueueFull):
+            queue.put('test_append', [3])
+
+    def test_get_stats_success(self):
+        Question(question='Who painted The Night Watch?', answer='Rembrandt', category=2, difficulty=4).insert()
+        Question.bulk_delete([Question.get_questions()[0].get('id')])
+        questions = Question.get_questions()
+
+        res = self.client().get('/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data.get('success'))
+        self.assertEqual(data.get('total_questions'), len(questions))
+        for category in data.get('categories'):
+            expected = [q for q in questions if q.get('category') == category.get('id')]
+            self.assertEqual(category.get('total_questions'), len(expected))
+            for difficulty, total in category.get('difficulties').items():
+                self.assertEqual(total, len([q for q in expected if str(q.get('difficulty')) == difficulty]))
+        self.assertEqual(sum(data.get('difficulties').values()), len(questions))
+
+    def test_get_stats_fail(self):
+        res = self.client().post('/stats')
+
+        self.assertEqual(res.status_code, 405)
+
+    def test_sql_statements_per_endpoint_success(self):
+        # statements run once the category, count and quiz caches are warm,
+        # the quiz having a single question left to draw and saving its
+        # session; the endpoints with an ETag read the versions of their
+        # tables first
+        played = [question.get('id') for question in Question.get_questions_by_category_id(5)][:-1]
+        expected = [
+            ('get', '/categories', {}, 1),
+            ('get', '/questions', {}, 2),
+            ('get', '/questions?page=2', {}, 2),
+            ('get', '/categories/5/questions', {}, 2),
+            ('post', '/questions/search', {'json': {'searchTerm': 'who'}}, 1),
+            ('post', '/quizzes', {'json': {'previous_questions': played, 'quiz_category': {'id': 5}}}, 1)
+        ]
+        for method, path, kwargs, statements in expected:
+            getattr(self.client(), method)(path, **kwargs)
+            with StatementCounter() as counter:
+                res = getattr(self.client(), method)(path, **kwargs)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(counter.count, statements, '{} {}'.format(method.upper(), path))
+
+    def test_sql_statements_per_endpoint_fail(self):
+        with StatementCounter() as counter:
+            res = self.client().get('/categories/200/questions')
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(counter.count, 2)
+
     def test_quizzes_success(self):
         quizz = {
             'previous_questions': [],
@@ -253,6 +964,122 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data.get('question'))
 
+    def test_quizzes_session_success(self):
+        category_id = 5
+        expected = set(q.get('id') for q in Question.get_questions_by_category_id(category_id))
+        quizz = {
+            'quiz_category': {
+                'id': category_id
+            }
+        }
+        played = set()
+
+        for _ in range(len(expected)):
+            res = self.client().post('/quizzes', json=quizz)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn(data.get('question').get('id'), played)
+            played.add(data.get('question').get('id'))
+            quizz['quiz_session'] = data.get('quiz_session')
+
+        res = self.client().post('/quizzes', json=quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(played, expected)
+        self.assertFalse(data.get('question'))
+
+    def test_quizzes_session_fail(self):
+        quizz = {
+            'quiz_session': 'unknown',
+            'quiz_category': {
+                'id': 5
+            }
+        }
+
+        res = self.client().post('/quizzes', json=quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data.get('message'), 'Quiz session unknown not found')
+
+    def test_quizzes_deleted_question_success(self):
+        question_ids = [question.get('id') for question in Question.get_questions_by_category_id(5)]
+        # deleted as by another worker, without bumping the version of this one
+        db.session.execute(Question.__table__.delete().where(Question.id == question_ids[0]))
+        db.session.commit()
+
+        for _ in range(10):
+            res = self.client().post('/quizzes', json={'quiz_category': {'id': 5}})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data.get('question').get('id'), question_ids[1])
+
+    def test_quizzes_played_question_deleted_success(self):
+        quizz = {'quiz_category': {'id': 0}, 'previous_questions': []}
+        res = self.client().post('/quizzes', json=quizz)
+        played = json.loads(res.data).get('question').get('id')
+        quizz['previous_questions'].append(played)
+        res = self.client().post('/quizzes', json=quizz)
+        quizz['previous_questions'].append(json.loads(res.data).get('question').get('id'))
+        # the highest id played is deleted mid-quiz, and another worker inserts a question this one has not loaded
+        self.client().delete('/questions/{}'.format(max(quizz['previous_questions'])))
+        inserted = db.session.execute(Question.__table__.insert().values(
+            question='Who painted Guernica?', answer='Picasso', category=2, difficulty=1)).lastrowid
+        db.session.commit()
+        quizz['previous_questions'].append(inserted)
+
+        res = self.client().post('/quizzes', json=quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn(data.get('question').get('id'), quizz['previous_questions'])
+
+    def test_quiz_session_shared_by_workers_success(self):
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 0}})
+        first = json.loads(res.data)
+        # another worker, whose memory cache knows nothing of the session
+        backend, cache.backend = cache.backend, MemoryBackend()
+        self.addCleanup(setattr, cache, 'backend', backend)
+
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 0},
+                                                   'quiz_session': first.get('quiz_session')})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(data.get('question').get('id'), first.get('question').get('id'))
+
+    def test_quiz_session_expired_fail(self):
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 0}})
+        token = json.loads(res.data).get('quiz_session')
+        db.session.execute(text('UPDATE quiz_sessions SET expires_at = 0 WHERE token = :token'), {'token': token})
+        db.session.commit()
+
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 0}, 'quiz_session': token})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_quiz_session_encoding_success(self):
+        seen = SeenSet([3, 1, 1000000])
+
+        # sorted ids as hex differences, whatever their size
+        self.assertEqual(seen.dumps(), '1,2,f423d')
+        self.assertEqual(sorted(SeenSet.loads(seen.dumps())), [1, 3, 1000000])
+
+    def test_quizzes_previous_questions_fail(self):
+        quizz = {
+            'previous_questions': list(range(1, 10002)),
+            'quiz_category': {
+                'id': 5
+            }
+        }
+
+        res = self.client().post('/quizzes', json=quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message'), 'Previous questions must be a list of at most 10000 question ids')
+
     def test_quizzes_fail(self):
         quizz = {
         }
@@ -263,6 +1090,372 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data.get('message'), 'Quiz category is required')
 
+    def test_quizzes_all_categories_success(self):
+        expected = set(question.get('id') for question in Question.get_questions())
+        played = set()
+        quizz = {
+            'quiz_category': {
+                'id': 0
+            }
+        }
+
+        res = self.client().post('/quizzes', json=quizz)
+        data = json.loads(res.data)
+        while data.get('question'):
+            played.add(data.get('question').get('id'))
+            quizz['quiz_session'] = data.get('quiz_session')
+            res = self.client().post('/quizzes', json=quizz)
+            data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(played, expected)
+
+    def test_quizzes_target_difficulty_success(self):
+        quizz = {
+            'quiz_category': {
+                'id': 0
+            },
+            'mode': 'target',
+            'difficulty': 5
+        }
+
+        res = self.client().post('/quizzes', json=quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data.get('question').get('difficulty'), 5)
+        self.assertEqual(data.get('difficulty'), 5)
+
+    def test_quizzes_adaptive_success(self):
+        difficulties = sorted(set(question.get('difficulty') for question in Question.get_questions()))
+        quizz = {
+            'quiz_category': {
+                'id': 0
+            },
+            'mode': 'adaptive'
+        }
+
+        first = json.loads(self.client().post('/quizzes', json=quizz).data)
+        quizz.update({'quiz_session': first.get('quiz_session'), 'correct': True})
+        second = json.loads(self.client().post('/quizzes', json=quizz).data)
+        quizz.update({'correct': False})
+        third = json.loads(self.client().post('/quizzes', json=quizz).data)
+
+        self.assertEqual(first.get('difficulty'), difficulties[0])
+        self.assertEqual(first.get('question').get('difficulty'), difficulties[0])
+        self.assertEqual(second.get('difficulty'), difficulties[1])
+        self.assertEqual(third.get('difficulty'), difficulties[0])
+
+    def test_quizzes_mode_fail(self):
+        quizz = {
+            'quiz_category': {
+                'id': 0
+            },
+            'mode': 'target'
+        }
+
+        res = self.client().post('/quizzes', json=quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message'), 'Difficulty is required by the target mode')
+
+    def test_quiz_round_success(self):
+        total = len(Question.get_questions())
+
+        res = self.client().post('/quizzes/round', json={'quiz_category': {'id': 0}, 'size': total - 2})
+        first = json.loads(res.data)
+        res = self.client().post('/quizzes/round', json={'quiz_category': {'id': 0}, 'size': total,
+                                                         'quiz_session': first.get('quiz_session')})
+        second = json.loads(res.data)
+        question_ids = [q.get('id') for q in first.get('questions') + second.get('questions')]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(first.get('questions')), total - 2)
+        self.assertEqual(len(second.get('questions')), 2)
+        self.assertEqual(len(set(question_ids)), total)
+        self.assertTrue(all('answer' not in q and q.get('question') for q in first.get('questions')))
+
+    def test_quiz_round_fail(self):
+        res = self.client().post('/quizzes/round', json={'quiz_category': {'id': 0}, 'size': 500})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message'), 'Size must be an integer from 1 to 50')
+
+    def test_quiz_answers_success(self):
+        drawn = json.loads(self.client().post('/quizzes/round', json={'quiz_category': {'id': 0}, 'size': 2}).data)
+        expected = dict((q.get('id'), q.get('answer')) for q in Question.get_questions())
+        questions = [{'id': q.get('id'), 'answer': expected.get(q.get('id'))} for q in drawn.get('questions')]
+        answers = [
+            {'id': questions[0].get('id'), 'answer': '  {} '.format(questions[0].get('answer').upper())},
+            {'id': questions[1].get('id'), 'answer': 'not the answer'}
+        ]
+
+        with StatementCounter() as counter:
+            res = self.client().post('/quizzes/answers', json={'answers': answers,
+                                                               'quiz_session': drawn.get('quiz_session')})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(counter.count, 1)
+        self.assertEqual([r.get('correct') for r in data.get('results')], [True, False])
+        self.assertEqual(data.get('results')[1].get('answer'), questions[1].get('answer'))
+        self.assertEqual(data.get('score'), 1)
+
+    def test_quiz_answers_fail(self):
+        res = self.client().post('/quizzes/answers', json={'answers': [{'answer': 'Apollo 13'}]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message')[0].get('field'), 'answers')
+        self.assertFalse(data.get('success'))
+
+    def test_quiz_answers_undrawn_fail(self):
+        question = Question.get_questions()[0]
+        # a question sent as played was not drawn for the quiz
+        res = self.client().post('/quizzes/round', json={'quiz_category': {'id': 0}, 'size': 1,
+                                                         'previous_questions': [question.get('id')]})
+        token = json.loads(res.data).get('quiz_session')
+        answers = [{'id': question.get('id'), 'answer': 'guess'}]
+
+        missing = self.client().post('/quizzes/answers', json={'answers': answers})
+        unknown = self.client().post('/quizzes/answers', json={'answers': answers, 'quiz_session': 'unknown'})
+        res = self.client().post('/quizzes/answers', json={'answers': answers, 'quiz_session': token})
+        data = json.loads(res.data)
+
+        self.assertEqual(missing.status_code, 400)
+        self.assertEqual(json.loads(missing.data).get('message')[0].get('field'), 'quiz_session')
+        self.assertEqual(unknown.status_code, 404)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data.get('message')[0].get('field'), 'answers')
+        self.assertNotIn(question.get('answer'), res.get_data(as_text=True))
+
+    def create_tenant_app(self, tenants):
+        """App serving `tenants`, each from a database file of the test"""
+        # the tenants write to their own databases rather than within the
+        # rolled back transaction
+        self.transaction.__exit__(None, None, None)
+        self.transaction = contextlib.nullcontext()
+        app = create_app(dict(TEST_CONFIG, TENANTS=tenants,
+                              TENANT_DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), '{tenant}.db')))
+
+        def forget_tenants():
+            for tenant in tenants:
+                with app.app_context():
+                    g.tenant = tenant
+                    question_cache.bump()
+                    category_cache.bump()
+                drop_tenant(tenant)
+
+        self.addCleanup(forget_tenants)
+        return app
+
+    def test_tenants_success(self):
+        client = self.create_tenant_app(['acme', 'globex']).test_client()
+        question = {'question': 'Who wrote Hamlet?', 'answer': 'Shakespeare', 'category': None, 'difficulty': 1}
+
+        res = client.post('/questions', json=question, headers={'X-Tenant': 'acme'})
+        acme = client.get('/questions', headers={'X-Tenant': 'acme'})
+        globex = client.get('/questions', base_url='http://globex.trivia.test')
+        pools = json.loads(client.get('/db/stats').data).get('pools')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(json.loads(acme.data).get('total_questions'), 1)
+        self.assertEqual(json.loads(globex.data).get('total_questions'), 0)
+        self.assertNotEqual(acme.headers.get('ETag'), globex.headers.get('ETag'))
+        self.assertIn('X-Tenant', acme.headers.get('Vary'))
+        self.assertIn('tenant:acme', pools)
+        self.assertIn('tenant:globex', pools)
+
+    def test_tenants_fail(self):
+        client = self.create_tenant_app(['acme']).test_client()
+
+        res = client.get('/questions', headers={'X-Tenant': 'initech'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data.get('message'), 'Unknown tenant initech')
+        # the worker endpoints need no tenant
+        self.assertEqual(client.get('/healthz').status_code, 200)
+
+    def test_tenant_engines_success(self):
+        migrating = threading.Event()
+        release = threading.Event()
+
+        def create(tenant):
+            if tenant == 'acme':
+                migrating.set()
+                release.wait(5)
+            return 'engine:' + tenant
+
+        engines = TenantEngines(create)
+        thread = threading.Thread(target=engines.get, args=('acme',))
+        thread.start()
+        migrating.wait(5)
+        # the engine of another tenant is created while acme migrates
+        globex = engines.get('globex')
+        release.set()
+        thread.join(5)
+
+        self.assertEqual(globex, 'engine:globex')
+        self.assertEqual(engines.get('acme'), 'engine:acme')
+        self.assertEqual(sorted(engines.items()), [('acme', 'engine:acme'), ('globex', 'engine:globex')])
+
+    def test_coalesced_reads_success(self):
+        flight = SingleFlight('test_read')
+        calls = []
+        results = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def read():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ['question']
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('page:1', read))) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # the other callers wait for the read in flight
+        deadline = time.time() + 5
+        while flight.shared < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.client().get('/questions')
+        data = json.loads(self.client().get('/cache/stats').data)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['question']] * 4)
+        self.assertEqual(flight.stats().get('ratio'), 0.75)
+        self.assertGreaterEqual(data.get('coalescing').get('Question.get_questions_page').get('calls'), 1)
+
+    def test_coalesced_reads_fail(self):
+        flight = SingleFlight('test_broken_read', ttl=60)
+
+        def broken():
+            raise ValueError('broken')
+
+        with self.assertRaises(ValueError):
+            flight.do('page:1', broken)
+
+        # a failed read is not kept, the next caller runs it again
+        self.assertEqual(flight.do('page:1', lambda: ['question']), ['question'])
+        self.assertEqual(flight.do('page:1', broken), ['question'])
+        self.assertEqual(flight.stats().get('hits'), 1)
+
+    def test_asgi_shutdown_while_streaming_success(self):
+        release = threading.Event()
+
+        def streaming_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            yield b'first'
+            release.wait(5)
+            yield b'second'
+
+        asgi_app = AsgiApp(streaming_app, threads=2)
+        scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': '/',
+                 'query_string': b'', 'headers': [], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0)}
+        sent = []
+
+        async def serve():
+            first = asyncio.Event()
+
+            async def send(message):
+                sent.append(message)
+                if message.get('body') == b'first':
+                    first.set()
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def shutdown():
+                return {'type': 'lifespan.shutdown'}
+
+            request = asyncio.ensure_future(asgi_app(scope, receive, send))
+            await first.wait()
+            # the response goes on streaming while the worker shuts down
+            threading.Timer(0.1, release.set).start()
+            await asyncio.wait_for(asgi_app({'type': 'lifespan'}, shutdown, send), 5)
+            await request
+
+        asyncio.run(serve())
+
+        self.assertEqual(b''.join(message.get('body', b'') for message in sent), b'firstsecond')
+        self.assertIn({'type': 'lifespan.shutdown.complete'}, sent)
+
+
+class AsgiTestClient(object):
+    """Test client sending the requests through the ASGI app of asgi.py"""
+
+    def __init__(self, app):
+        self.app = app
+        self.asgi_app = AsgiApp(app)
+
+    def open(self, *args, **kwargs):
+        builder = make_test_environ_builder(self.app, *args, **kwargs)
+        try:
+            environ = builder.get_environ()
+            body = environ['wsgi.input'].read()
+        finally:
+            builder.close()
+        headers = []
+        for key, value in environ.items():
+            if key.startswith('HTTP_') or key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = key[5:] if key.startswith('HTTP_') else key
+                headers.append((name.lower().replace('_', '-').encode('latin-1'), value.encode('latin-1')))
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': environ['REQUEST_METHOD'],
+            'scheme': 'http',
+            'path': environ['PATH_INFO'].encode('latin-1').decode('utf-8'),
+            'query_string': environ['QUERY_STRING'].encode('latin-1'),
+            'headers': headers,
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 0)
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.asgi_app(scope, receive, send))
+        start = messages[0]
+        return Response(b''.join(message.get('body', b'') for message in messages[1:]), status=start['status'],
+                        headers=[(name.decode('latin-1'), value.decode('latin-1'))
+                                 for name, value in start['headers']])
+
+    def get(self, *args, **kwargs):
+        return self.open(*args, method='GET', **kwargs)
+
+    def post(self, *args, **kwargs):
+        return self.open(*args, method='POST', **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.open(*args, method='DELETE', **kwargs)
+
+    def close(self):
+        self.asgi_app.close()
+
+
+class TriviaAsgiTestCase(TriviaTestCase):
+    """Runs the trivia test case against the ASGI app"""
+
+    def setUp(self):
+        super(TriviaAsgiTestCase, self).setUp()
+        client = AsgiTestClient(self.app)
+        self.client = lambda: client
+        self.addCleanup(client.close)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":